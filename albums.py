@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+from aiogram import types
+
+logger = logging.getLogger(__name__)
+
+
+def input_media(message: types.Message):
+    # Повторная отправка по file_id: файл заново не загружается
+    caption = message.caption
+    if message.photo:
+        return types.InputMediaPhoto(media=message.photo[-1].file_id, caption=caption)
+    if message.video:
+        return types.InputMediaVideo(media=message.video.file_id, caption=caption)
+    if message.audio:
+        return types.InputMediaAudio(media=message.audio.file_id, caption=caption)
+    if message.document:
+        return types.InputMediaDocument(media=message.document.file_id, caption=caption)
+    return None
+
+
+async def send_media(bot, chat_id, media_type: str, file_id: str, caption: str = None):
+    # Отправка сохранённого вложения по file_id — без загрузки и без пересылки из чата пользователя
+    if media_type == "photo":
+        return await bot.send_photo(chat_id, file_id, caption=caption)
+    if media_type == "document":
+        return await bot.send_document(chat_id, file_id, caption=caption)
+    if media_type == "voice":
+        return await bot.send_voice(chat_id, file_id, caption=caption)
+    if media_type == "video":
+        return await bot.send_video(chat_id, file_id, caption=caption)
+    if media_type == "audio":
+        return await bot.send_audio(chat_id, file_id, caption=caption)
+    if media_type == "sticker":
+        return await bot.send_sticker(chat_id, file_id)
+    if media_type == "video_note":
+        return await bot.send_video_note(chat_id, file_id)
+    raise ValueError(f"Неизвестный тип вложения: {media_type}")
+
+
+# === Сборка альбомов (media_group_id) перед отправкой админу ===
+# Части альбома приходят отдельными обновлениями; ждём window_ms после последней части
+# и отдаём весь альбом одним вызовом deliver(items). Обработчик при этом не ждёт.
+class MediaGroupAggregator:
+    def __init__(self, deliver, window_ms=800):
+        self.deliver = deliver
+        self.window = window_ms / 1000
+        self._groups = {}
+        self._timers = {}
+        self._tasks = set()
+
+    @property
+    def pending(self):
+        return len(self._groups)
+
+    def add(self, message: types.Message, item):
+        key = message.media_group_id
+        self._groups.setdefault(key, []).append(item)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+    def _flush(self, key):
+        self._timers.pop(key, None)
+        items = self._groups.pop(key, None)
+        if not items:
+            return
+        task = asyncio.create_task(self._deliver(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, key, items):
+        try:
+            await self.deliver(items)
+        except Exception:
+            logger.exception("Не удалось доставить альбом %s", key)
+
+    async def stop(self):
+        for key in list(self._groups):
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,127 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+ALLOW = 'allow'
+DROP = 'drop'
+MUTE = 'mute'
+
+
+def parse_flood_limits(value: str) -> dict:
+    # "default:20/60,sticker:5/30" -> {"default": (20, 60.0), "sticker": (5, 30.0)}
+    # Не больше N обновлений за M секунд; callback — нажатия инлайн-кнопок
+    limits = {}
+    for part in (value or '').split(','):
+        if ':' in part:
+            kind, rule = part.split(':', 1)
+            try:
+                count, seconds = rule.split('/', 1)
+                count, seconds = int(count), float(seconds)
+            except ValueError:
+                count = seconds = 0
+            if count < 1 or seconds <= 0:
+                raise ValueError(f"Неверное правило FLOOD_LIMITS: {part.strip()} (нужно тип:N/секунд)")
+            limits[kind.strip()] = (count, seconds)
+    return limits
+
+
+# === Скользящее окно по пользователю и типу контента ===
+# Храним время последних limit обновлений: окно переполнено, если самое старое из них моложе window.
+# Ключей не больше max_keys: дольше всех молчавшие вытесняются первыми.
+class FloodLimiter:
+    def __init__(self, limits, mute_seconds=60, max_keys=10000):
+        self.limits = dict(limits)
+        self.default = self.limits.pop('default', None)
+        self.mute_seconds = mute_seconds
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._muted = OrderedDict()
+        self.dropped = 0
+        self.mutes = 0
+
+    def _limit(self, kind):
+        return self.limits.get(kind, self.default)
+
+    def muted_for(self, user_id, now) -> float:
+        until = self._muted.get(user_id)
+        if until is None:
+            return 0.0
+        if now >= until:
+            del self._muted[user_id]
+            return 0.0
+        return until - now
+
+    def check(self, user_id, kind, now) -> str:
+        if self.muted_for(user_id, now):
+            self.dropped += 1
+            return DROP
+        limit = self._limit(kind)
+        if limit is None:
+            return ALLOW
+        count, window = limit
+        key = (user_id, kind)
+        hits = self._windows.get(key)
+        if hits is None:
+            hits = self._windows[key] = deque(maxlen=count)
+            if len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        if len(hits) == count and now - hits[0] < window:
+            self.dropped += 1
+            self.mutes += 1
+            self._mute(user_id, now)
+            return MUTE
+        hits.append(now)
+        return ALLOW
+
+    def _mute(self, user_id, now):
+        self._muted[user_id] = now + self.mute_seconds
+        self._muted.move_to_end(user_id)
+        while len(self._muted) > self.max_keys:
+            self._muted.popitem(last=False)
+
+
+def _update_kind(update) -> str:
+    if update.message is not None:
+        content_type = update.message.content_type
+        return getattr(content_type, 'value', content_type)
+    if update.callback_query is not None:
+        return 'callback'
+    return update.event_type
+
+
+# === Отбрасываем флуд до обработчиков: до базы и пересылки админу он не доходит ===
+# Вместо сотни пересланных стикеров — одно предупреждение пользователю на время заглушения.
+class AntiFloodMiddleware(BaseMiddleware):
+    def __init__(self, limiter, exempt=None, metrics=None):
+        self.limiter = limiter
+        self.exempt = exempt or (lambda user_id: False)
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or self.exempt(user.id):
+            return await handler(event, data)
+
+        kind = _update_kind(event)
+        verdict = self.limiter.check(user.id, kind, time.monotonic())
+        if verdict == ALLOW:
+            return await handler(event, data)
+
+        if self.metrics is not None:
+            self.metrics.dropped_updates.inc(kind)
+        if verdict == MUTE:
+            logger.info("Пользователь %s заглушён на %s с (%s)", user.id, self.limiter.mute_seconds, kind)
+            try:
+                await data['bot'].send_message(
+                    user.id,
+                    f"⏳ Слишком много сообщений. Подождите {int(self.limiter.mute_seconds)} с — "
+                    f"до этого новые сообщения не доходят до администратора."
+                )
+            except Exception:
+                logger.exception("Не удалось предупредить пользователя %s о флуде", user.id)
@@ -0,0 +1,154 @@
+import time
+
+from aiogram import BaseMiddleware
+
+ROUTING_LEAST_LOADED = 'least_loaded'
+ROUTING_ROUND_ROBIN = 'round_robin'
+
+# Активность админа записывается в общее состояние не чаще, чем раз в столько секунд
+ACTIVITY_RESOLUTION = 10
+
+
+def parse_admin_ids(value: str) -> list:
+    # "111,222,333" -> [111, 222, 333], порядок сохраняется, повторы убираются
+    ids = [int(part) for part in (value or '').split(',') if part.strip()]
+    return list(dict.fromkeys(ids))
+
+
+# === Пул администраторов и распределение диалогов ===
+# Новый диалог получает наименее загруженный админ (или следующий по кругу).
+# Дальше диалог закреплён за ним, пока админ не завершит его или не станет неактивным.
+# Закрепления хранятся в базе (таблица assignments), читаются через общее состояние (state.py),
+# активность и счётчики тоже лежат там — так их видят все воркеры.
+class AdminPool:
+    def __init__(self, storage, state, admin_ids, strategy=ROUTING_LEAST_LOADED, idle_minutes=0, ttl=3600):
+        if not admin_ids:
+            raise ValueError("Список администраторов пуст")
+        if strategy not in (ROUTING_LEAST_LOADED, ROUTING_ROUND_ROBIN):
+            raise ValueError(f"Неизвестная стратегия распределения: {strategy}")
+        self.storage = storage
+        self.state = state
+        self.admin_ids = list(admin_ids)
+        self._admin_set = frozenset(self.admin_ids)
+        self.strategy = strategy
+        self.idle_seconds = idle_minutes * 60
+        self.ttl = ttl
+        self._touched = {}
+
+    async def load(self):
+        now = time.time()
+        for admin_id in self.admin_ids:
+            # До первого действия после запуска админ считается активным
+            if await self.state.get(f"admin:{admin_id}:active") is None:
+                await self.state.set(f"admin:{admin_id}:active", now)
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self._admin_set
+
+    # === Активность админов ===
+    async def touch(self, admin_id: int):
+        now = time.time()
+        if now - self._touched.get(admin_id, 0) < ACTIVITY_RESOLUTION:
+            return
+        self._touched[admin_id] = now
+        await self.state.set(f"admin:{admin_id}:active", now)
+
+    async def record_reply(self, admin_id: int):
+        await self.state.incr(f"admin:{admin_id}:replies")
+
+    async def _idle_for(self, admin_id):
+        last_active = await self.state.get(f"admin:{admin_id}:active")
+        return time.time() - last_active if last_active is not None else 0
+
+    async def _available(self, admin_id):
+        if admin_id not in self._admin_set:
+            return False
+        return not self.idle_seconds or await self._idle_for(admin_id) < self.idle_seconds
+
+    # === Закрепление ===
+    async def _get(self, user_id):
+        owner = await self.state.get(f"assign:{user_id}")
+        if owner is None:
+            owner = await self.storage.get_assignment(user_id) or (None, False)
+            await self.state.set(f"assign:{user_id}", list(owner), ttl=self.ttl)
+        return tuple(owner)
+
+    async def _pick(self, exclude=None):
+        available = [a for a in self.admin_ids if a != exclude and await self._available(a)]
+        # Все неактивны — всё равно кому-то отдаём, лишь бы не потерять сообщение
+        candidates = available or [a for a in self.admin_ids if a != exclude] or self.admin_ids
+        if self.strategy == ROUTING_ROUND_ROBIN:
+            start = await self.state.incr("admins:round_robin")
+            for i in range(len(self.admin_ids)):
+                admin_id = self.admin_ids[(start + i) % len(self.admin_ids)]
+                if admin_id in candidates:
+                    return admin_id
+        # Открытые диалоги считаем по базе: закрепления могли поменять другие воркеры
+        open_dialogs = await self.storage.count_open_dialogs()
+        assigned = {a: await self.state.get(f"admin:{a}:assigned") or 0 for a in candidates}
+        return min(candidates, key=lambda a: (open_dialogs.get(a, 0), assigned[a]))
+
+    async def _assign(self, user_id, admin_id):
+        await self.storage.assign_dialog(user_id, admin_id)
+        await self.state.incr(f"admin:{admin_id}:assigned")
+        await self.state.set(f"assign:{user_id}", [admin_id, True], ttl=self.ttl)
+
+    async def route(self, user_id: int) -> int:
+        # Кому переслать сообщение пользователя
+        owner, is_open = await self._get(user_id)
+        if is_open and await self._available(owner):
+            return owner
+        async with self.state.lock(f"assign:{user_id}"):
+            owner, is_open = await self._get(user_id)
+            if is_open and await self._available(owner):
+                return owner
+            if not is_open and owner is not None and await self._available(owner):
+                # Вернувшийся пользователь попадает к тому же админу
+                admin_id = owner
+            else:
+                admin_id = await self._pick(exclude=owner)
+            await self._assign(user_id, admin_id)
+            return admin_id
+
+    async def claim(self, user_id: int, admin_id: int):
+        # Админ сам взял диалог (кнопка «Ответить» или ввод ID); возвращает прежнего владельца
+        async with self.state.lock(f"assign:{user_id}"):
+            owner, is_open = await self._get(user_id)
+            if is_open and owner == admin_id:
+                return owner
+            await self._assign(user_id, admin_id)
+            return owner if is_open else None
+
+    async def close(self, user_id: int):
+        async with self.state.lock(f"assign:{user_id}"):
+            owner, is_open = await self._get(user_id)
+            if not is_open:
+                return
+            await self.storage.close_dialog(user_id)
+            await self.state.set(f"assign:{user_id}", [owner, False], ttl=self.ttl)
+
+    async def stats(self) -> list:
+        open_dialogs = await self.storage.count_open_dialogs()
+        return [
+            {
+                'admin_id': admin_id,
+                'open': open_dialogs.get(admin_id, 0),
+                'assigned': await self.state.get(f"admin:{admin_id}:assigned") or 0,
+                'replies': await self.state.get(f"admin:{admin_id}:replies") or 0,
+                'idle_seconds': int(await self._idle_for(admin_id)),
+                'available': await self._available(admin_id),
+            }
+            for admin_id in self.admin_ids
+        ]
+
+
+# === Отмечаем активность админа по любому его обновлению ===
+class AdminActivityMiddleware(BaseMiddleware):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is not None and self.pool.is_admin(user.id):
+            await self.pool.touch(user.id)
+        return await handler(event, data)
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.filters import Command
+
+from content_types import CONTENT_TYPES, is_routed_content
+
+# === Стоимость диспетчеризации: цепочка F.*-фильтров против таблицы CONTENT_TYPES ===
+# Запуск: python bench/bench_dispatch.py [--updates 20000]
+# Обработчики пустые, поэтому измеряется только проверка фильтров и проход по роутеру.
+ADMIN_BUTTONS = ["👥 Пользователи", "🗂 История", "🧹 Очистить старые", "🗑 Очистить всё", "⏹ Завершить диалог"]
+USER_BUTTONS = ["📝 Оставить заявку на работу", "❓ Задать вопрос", "❌ Отмена"]
+MEDIA_FILTERS = [F.photo, F.document, F.voice, F.video, F.audio, F.sticker, F.video_note, F.contact, F.location, F.poll]
+
+SAMPLES = {
+    "text": {"text": "Здравствуйте"},
+    "photo": {"photo": [{"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}]},
+    "document": {"document": {"file_id": "f", "file_unique_id": "u"}},
+    "voice": {"voice": {"file_id": "f", "file_unique_id": "u", "duration": 1}},
+    "sticker": {"sticker": {"file_id": "f", "file_unique_id": "u", "type": "regular", "width": 1, "height": 1,
+                            "is_animated": False, "is_video": False}},
+    "location": {"location": {"latitude": 1.0, "longitude": 2.0}},
+    "poll": {"poll": {"id": "p", "question": "?", "options": [], "total_voter_count": 0, "is_closed": False,
+                      "is_anonymous": True, "type": "regular", "allows_multiple_answers": False}},
+}
+
+
+async def noop(message: types.Message):
+    pass
+
+
+def _common_head(dp):
+    dp.message(Command('start'))(noop)
+    dp.message(Command('menu', 'меню'))(noop)
+    dp.message(Command('users'))(noop)
+    dp.message(lambda msg: msg.text in ADMIN_BUTTONS)(noop)
+    dp.message(F.text.isdigit())(noop)
+    dp.message(lambda msg: msg.text in USER_BUTTONS)(noop)
+
+
+def filter_chain_dispatcher():
+    # Как было: текстовые фильтры, затем десять F.*-обработчиков по очереди
+    dp = Dispatcher()
+    _common_head(dp)
+    dp.message(F.text & ~F.text.startswith('/'))(noop)
+    for media_filter in MEDIA_FILTERS:
+        dp.message(media_filter)(noop)
+    dp.message(Command('history'))(noop)
+    dp.message(Command('clear_all_dialogs'))(noop)
+    return dp
+
+
+def table_dispatcher():
+    # Как стало: один обработчик с поиском в словаре перед остальными
+    dp = Dispatcher()
+    dp.message(is_routed_content)(noop)
+    _common_head(dp)
+    dp.message(F.text & ~F.text.startswith('/'))(noop)
+    dp.message(Command('history'))(noop)
+    dp.message(Command('clear_all_dialogs'))(noop)
+    return dp
+
+
+def make_update(update_id, fields):
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Bench"},
+        **fields,
+    }
+    return types.Update(update_id=update_id, message=message)
+
+
+async def measure(dp, bot, update, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    assert set(SAMPLES) - {"text"} <= set(CONTENT_TYPES)
+    bot = Bot(token="42:BENCH")
+    chain, table = filter_chain_dispatcher(), table_dispatcher()
+
+    print(f"{'тип':<10} {'цепочка, мкс':>14} {'таблица, мкс':>14} {'ускорение':>10}")
+    for i, (name, fields) in enumerate(SAMPLES.items()):
+        update = make_update(i, fields)
+        await measure(chain, bot, update, 200)
+        await measure(table, bot, update, 200)
+        old = await measure(chain, bot, update, args.updates)
+        new = await measure(table, bot, update, args.updates)
+        print(f"{name:<10} {old:>14.1f} {new:>14.1f} {old / new:>9.2f}x")
+    await bot.session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+# === Локальная подмена Telegram Bot API для нагрузочных тестов ===
+# Отвечает на sendMessage, forwardMessage, copyMessage, sendMediaGroup, getUpdates и т.д.,
+# добавляет настраиваемую задержку и с заданной вероятностью отвечает 429.
+# Можно запустить отдельно: python bench/fake_api.py --port 8081 --latency-ms 30
+class FakeBotAPI:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.updates = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.url = None
+
+    # === Ответы ===
+    def _message(self, params, **extra):
+        chat_id = params.get("chat_id", 0)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 42, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method in ("forwardMessage", "sendPhoto", "sendDocument"):
+            return self._message(params)
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in ("forwardMessages", "copyMessages"):
+            return [{"message_id": next(self._message_ids)} for _ in params.get("message_ids", [])]
+        if method == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media", [])]
+        return True
+
+    async def _parse(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        data = await request.post()
+        params = {}
+        for key, value in data.items():
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await self._parse(request)
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def _get_updates(self, params):
+        timeout = float(params.get("timeout", 0) or 0)
+        result = []
+        try:
+            result.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return result
+        while not self.updates.empty() and len(result) < 100:
+            result.append(self.updates.get_nowait())
+        return result
+
+    # === Сервер ===
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    api = FakeBotAPI(args.latency_ms, args.jitter_ms, args.error_rate, args.retry_after)
+    url = await api.start(args.host, args.port)
+    print(f"Fake Bot API: {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    asyncio.run(_serve(parser.parse_args()))
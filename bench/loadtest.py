@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from aiogram import types
+
+from bench_dispatch import SAMPLES
+from fake_api import FakeBotAPI
+
+# === Нагрузочный тест: Dispatcher из main.py против локальной подмены Bot API ===
+# python bench/loadtest.py --users 200 --messages 10 --latency-ms 30
+# python bench/loadtest.py --baseline bench/baseline.json          # сравнить с эталоном
+# python bench/loadtest.py --write-baseline bench/baseline.json    # обновить эталон
+# Код выхода 1, если какой-то показатель хуже эталона больше чем на --tolerance.
+ADMIN_ID = 1
+USER_ID_BASE = 100000
+
+# Чем больше, тем лучше; для остальных показателей — наоборот
+HIGHER_IS_BETTER = {"updates_per_sec"}
+COMPARED = ("updates_per_sec", "p50_ms", "p99_ms", "api_calls_per_update", "db_bytes_per_update")
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(','):
+        name, weight = part.split(':')
+        if name not in SAMPLES:
+            raise SystemExit(f"Неизвестный тип контента: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def db_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+# === Генератор обновлений ===
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def message(self, user_id, **fields):
+        update_id = next(self._ids)
+        return types.Update(update_id=update_id, message={
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+            **fields,
+        })
+
+    def callback(self, user_id, data):
+        update_id = next(self._ids)
+        return types.Update(update_id=update_id, callback_query={
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "chat_instance": "loadtest",
+            "data": data,
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "-"},
+        })
+
+
+def user_script(factory, user_id, messages, mix, rnd):
+    # Поведение заявителя: /start, кнопка, (вакансия), затем сообщения разных типов
+    yield factory.message(user_id, text="/start")
+    if rnd.random() < 0.5:
+        yield factory.message(user_id, text="📝 Оставить заявку на работу")
+        yield factory.callback(user_id, rnd.choice(["vacancy_translator", "vacancy_editor", "vacancy_cleaner", "vacancy_typist"]))
+    else:
+        yield factory.message(user_id, text="❓ Задать вопрос")
+    kinds, weights = zip(*mix.items())
+    for i in range(messages):
+        kind = rnd.choices(kinds, weights)[0]
+        fields = dict(SAMPLES[kind])
+        if kind == "text":
+            fields["text"] = f"Сообщение {i} от {user_id}"
+        yield factory.message(user_id, **fields)
+
+
+def admin_script(factory, user_ids):
+    for user_id in user_ids:
+        yield factory.callback(ADMIN_ID, f"reply_{user_id}")
+        yield factory.message(ADMIN_ID, text=f"Ответ для {user_id}")
+
+
+# === Прогон ===
+async def run(args):
+    api = FakeBotAPI(args.latency_ms, args.jitter_ms, args.error_rate, args.retry_after, seed=args.seed)
+    url = await api.start()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="linxy-bench-"), "bench.db")
+    os.environ.update({
+        "BOT_TOKEN": "42:LOADTEST",
+        "ADMIN_USER_ID": str(ADMIN_ID),
+        "DATABASE_URL": db_path,
+        "TELEGRAM_API_URL": url,
+    })
+    if not args.realistic_limits:
+        # Подмена API не ограничивает скорость — меряем сам бот, а не лимиты Telegram
+        os.environ.update({"SEND_GLOBAL_RATE": "1000000", "SEND_CHAT_RATE": "1000000", "SEND_CHAT_BURST": "1000000"})
+
+    import main
+
+    latencies = []
+
+    async def measure(handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    main.dp.update.outer_middleware(measure)
+    await main.dp.emit_startup(bot=main.bot)
+    size_before = db_size(db_path)
+
+    rnd = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    factory = UpdateFactory()
+    user_ids = [USER_ID_BASE + i for i in range(args.users)]
+    replied = [user_id for user_id in user_ids if rnd.random() < args.admin_replies]
+    scripts = [list(user_script(factory, user_id, args.messages, mix, random.Random(rnd.random()))) for user_id in user_ids]
+    scripts.append(list(admin_script(factory, replied)))
+    total_updates = sum(len(script) for script in scripts)
+
+    async def play(script):
+        # Обновления одного чата идут строго по порядку, разные чаты — параллельно
+        for update in script:
+            await main.dp.feed_update(main.bot, update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(script) for script in scripts))
+    elapsed = time.perf_counter() - started
+
+    await main.dp.emit_shutdown(bot=main.bot)
+    await main.bot.session.close()
+    await api.stop()
+    size_after = db_size(db_path)
+
+    api_calls = sum(count for method, count in api.calls.items() if method != "getUpdates")
+    return {
+        "users": args.users,
+        "updates": total_updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(total_updates / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "api_calls": api_calls,
+        "api_calls_per_update": round(api_calls / total_updates, 3),
+        "api_calls_by_method": dict(Counter(api.calls).most_common()),
+        "api_429": sum(api.errors.values()),
+        "db_bytes_growth": size_after - size_before,
+        "db_bytes_per_update": round((size_after - size_before) / total_updates, 1),
+    }
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for key in COMPARED:
+        if key not in baseline or not baseline[key]:
+            continue
+        old, new = baseline[key], report[key]
+        change = (new - old) / old
+        worse = -change if key in HIGHER_IS_BETTER else change
+        status = "РЕГРЕССИЯ" if worse > tolerance else "ok"
+        print(f"  {key:<22} {old:>12} -> {new:<12} {change:+.1%}  {status}")
+        if worse > tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: Dispatcher из main.py против локальной подмены Bot API")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=10, help="сообщений от каждого пользователя")
+    parser.add_argument("--mix", default="text:0.6,photo:0.15,document:0.1,voice:0.05,sticker:0.1")
+    parser.add_argument("--admin-replies", type=float, default=0.2, help="доля пользователей, которым отвечает админ")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--realistic-limits", action="store_true", help="не снимать лимиты отправки бота")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline")
+    parser.add_argument("--write-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Сравнение с {args.baseline}:")
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,103 @@
+from typing import Callable, NamedTuple
+
+from aiogram import types
+
+
+# === Описание типа контента ===
+# label — значение content_type в базе, content — что сохраняем за пользователем,
+# admin_echo — подпись перед копией ответа админа, admin_done — подтверждение админу.
+class ContentSpec(NamedTuple):
+    label: str
+    content: Callable[[types.Message], str]
+    admin_echo: Callable[[types.Message], str]
+    admin_done: str
+
+
+CONTENT_TYPES = {
+    "photo": ContentSpec(
+        "photo",
+        lambda m: m.caption or "Фото без описания",
+        lambda m: "🖼 Фото-ответ от администратора:",
+        "✅ Фото отправлено пользователю.",
+    ),
+    "document": ContentSpec(
+        "document",
+        lambda m: m.caption or "Документ",
+        lambda m: "📁 Документ-ответ от администратора:",
+        "✅ Документ отправлен пользователю.",
+    ),
+    "voice": ContentSpec(
+        "voice",
+        lambda m: "Голосовое сообщение",
+        lambda m: "🎤 Голосовой-ответ от администратора:",
+        "✅ Голос отправлен пользователю.",
+    ),
+    "video": ContentSpec(
+        "video",
+        lambda m: m.caption or "Видео",
+        lambda m: "📹 Видео-ответ от администратора:",
+        "✅ Видео отправлено пользователю.",
+    ),
+    "audio": ContentSpec(
+        "audio",
+        lambda m: m.caption or "Аудио",
+        lambda m: "🎵 Аудио-ответ от администратора:",
+        "✅ Аудио отправлено пользователю.",
+    ),
+    "sticker": ContentSpec(
+        "sticker",
+        lambda m: "Стикер",
+        lambda m: "😊 Стикер-ответ от администратора:",
+        "✅ Стикер отправлен пользователю.",
+    ),
+    "video_note": ContentSpec(
+        "video_note",
+        lambda m: "Видеосообщение",
+        lambda m: "📹 Видеосообщение-ответ от администратора:",
+        "✅ Видеосообщение отправлено пользователю.",
+    ),
+    "contact": ContentSpec(
+        "contact",
+        lambda m: f"Контакт: {m.contact.first_name}",
+        lambda m: f"👤 Контакт-ответ от администратора: {m.contact.first_name}",
+        "✅ Контакт отправлен пользователю.",
+    ),
+    "location": ContentSpec(
+        "location",
+        lambda m: f"Местоположение: {m.location.latitude}, {m.location.longitude}",
+        lambda m: f"📍 Местоположение-ответ от администратора: {m.location.latitude}, {m.location.longitude}",
+        "✅ Местоположение отправлено пользователю.",
+    ),
+    "poll": ContentSpec(
+        "poll",
+        lambda m: f"Опрос: {m.poll.question}",
+        lambda m: f"📊 Опрос-ответ от администратора: {m.poll.question}",
+        "✅ Опрос отправлен пользователю.",
+    ),
+}
+
+# Типы с файлом, который можно заново отправить по file_id
+MEDIA_TYPES = ("photo", "document", "voice", "video", "audio", "sticker", "video_note")
+
+
+def media_info(message: types.Message):
+    # (file_unique_id, file_id, media_type, file_size, mime_type) или None
+    for media_type in MEDIA_TYPES:
+        media = getattr(message, media_type, None)
+        if not media:
+            continue
+        if media_type == "photo":
+            media = media[-1]
+        return (
+            media.file_unique_id,
+            media.file_id,
+            media_type,
+            getattr(media, "file_size", None),
+            getattr(media, "mime_type", None),
+        )
+    return None
+
+
+async def is_routed_content(message: types.Message) -> bool:
+    # async: синхронные фильтры aiogram выполняет в пуле потоков
+    return message.content_type in CONTENT_TYPES
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+
+from history import MESSAGE_LIMIT, fit_text, text_length
+
+logger = logging.getLogger(__name__)
+
+
+def combine_texts(header: str, texts: list, limit: int = MESSAGE_LIMIT) -> list:
+    # Заголовок и тексты подряд, через пустую строку; не влезло в одно сообщение — продолжаем в следующем
+    messages, current = [], header
+    for text in texts:
+        text = f"\n\n{text}" if current else text
+        while text:
+            room = limit - text_length(current)
+            part = fit_text(text, room) if room > 0 else ''
+            if not part:
+                messages.append(current)
+                current, text = '', text.lstrip('\n')
+                continue
+            current += part
+            text = text[len(part):]
+    if current:
+        messages.append(current)
+    return messages
+
+
+# === Сводка для админа: сообщения одного пользователя копятся, пока он пишет ===
+# Отдаём пачку deliver(user_id, items), когда пользователь молчит window_ms, но не позже max_wait_ms
+# после первого сообщения и сразу, если набралось max_items. flush(user_id) — отдать без ожидания.
+class DigestBuffer:
+    def __init__(self, deliver, window_ms=5000, max_wait_ms=30000, max_items=20):
+        self.deliver = deliver
+        self.window = window_ms / 1000
+        self.max_wait = max_wait_ms / 1000
+        self.max_items = max_items
+        self._items = {}
+        self._started = {}
+        self._timers = {}
+        self._delivering = {}
+        self._tasks = set()
+
+    @property
+    def pending(self):
+        return len(self._items)
+
+    def add(self, user_id, item, urgent=False):
+        items = self._items.setdefault(user_id, [])
+        items.append(item)
+        loop = asyncio.get_running_loop()
+        started = self._started.setdefault(user_id, loop.time())
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        delay = min(self.window, started + self.max_wait - loop.time())
+        if urgent or len(items) >= self.max_items or delay <= 0:
+            self.flush(user_id)
+        else:
+            self._timers[user_id] = loop.call_later(delay, self.flush, user_id)
+
+    def flush(self, user_id):
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._started.pop(user_id, None)
+        items = self._items.pop(user_id, None)
+        if not items:
+            return
+        # Следующая пачка того же пользователя уходит только после предыдущей
+        previous = self._delivering.get(user_id)
+        task = asyncio.create_task(self._deliver(user_id, items, previous))
+        self._delivering[user_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._done(user_id, t))
+
+    def _done(self, user_id, task):
+        self._tasks.discard(task)
+        if self._delivering.get(user_id) is task:
+            del self._delivering[user_id]
+
+    async def _deliver(self, user_id, items, previous=None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.deliver(user_id, items)
+        except Exception:
+            logger.exception("Не удалось доставить сводку от пользователя %s", user_id)
+
+    async def stop(self):
+        for user_id in list(self._items):
+            self.flush(user_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,69 @@
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+PAGE_SIZE = 10
+CALLBACK_LIMIT = 64
+
+
+def _encode_ts(ts) -> str:
+    return ''.join(ch for ch in str(ts) if ch.isdigit())[:14]
+
+
+def _decode_ts(digits: str) -> str:
+    d = digits
+    return f"{d[0:4]}-{d[4:6]}-{d[6:8]} {d[8:10]}:{d[10:12]}:{d[12:14]}"
+
+
+def _fit_bytes(text: str, limit: int) -> str:
+    # callback_data ограничена 64 байтами
+    while len(text.encode()) > limit:
+        text = text[:-1]
+    return text
+
+
+def clamp_query(query: str) -> str:
+    # Оставляем запас под курсор самой длинной страницы: "users:" + 14 + ":" + id + ":"
+    return _fit_bytes((query or '').strip(), CALLBACK_LIMIT - 40)
+
+
+def parse_callback(data: str):
+    # users:<ts>:<user_id>:<query>; пустой курсор — первая страница
+    _, ts, user_id, query = data.split(':', 3)
+    before = (_decode_ts(ts), int(user_id)) if ts else None
+    return query, before
+
+
+# === Страница каталога пользователей ===
+async def build_users_page(storage, query: str = None, before: tuple = None):
+    query = clamp_query(query)
+    rows = await storage.search_users(query, before=before, limit=PAGE_SIZE + 1)
+    has_more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+
+    if not rows:
+        if before is None:
+            return ("❌ Никого не найдено." if query else "❌ Нет пользователей с перепиской."), None
+        return None, None
+
+    title = f"👥 Пользователи (поиск: «{query}»):\n" if query else "👥 Пользователи:\n"
+    text = title
+    builder = InlineKeyboardBuilder()
+    for user_id, first_name, username, last_seen in rows:
+        name = first_name or "Неизвестный"
+        uname = f" (@{username})" if username else ""
+        text += f"🆔 {user_id}: {name}{uname} — {last_seen}\n"
+        builder.button(text=f"💬 {name}{uname}", callback_data=f"reply_{user_id}")
+    text += (
+        "\n\nНажмите на пользователя или напишите его ID, чтобы начать диалог."
+        "\nПоиск: /users <имя, @username или ID>"
+    )
+
+    nav = 0
+    if before is not None:
+        builder.button(text="⏮ В начало", callback_data=f"users:::{query}")
+        nav += 1
+    if has_more:
+        user_id, _, _, last_seen = rows[-1]
+        builder.button(text="▶ Дальше", callback_data=f"users:{_encode_ts(last_seen)}:{user_id}:{query}")
+        nav += 1
+    builder.adjust(*([1] * len(rows)), *([nav] if nav else []))
+    return text, builder.as_markup()
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+from contextlib import aclosing
+from datetime import datetime, timedelta
+
+# === Выгрузка переписки в gzip-сжатый JSONL или CSV ===
+# Строки читаются курсором порциями и сразу пишутся в архив, поэтому память не растёт
+# с размером таблицы. Архив режется на части не больше part_size байт (лимит загрузки Telegram).
+EXPORT_FORMATS = ('jsonl', 'csv')
+# 6 вместо стандартных для gzip 9: втрое быстрее при архиве больше примерно на 10%
+COMPRESS_LEVEL = 6
+COLUMNS = ('id', 'timestamp', 'user_id', 'first_name', 'username', 'sender',
+           'content_type', 'content', 'media_type', 'file_id')
+
+
+def _parse_moment(value: str, end=False) -> str:
+    # "2026-01-31" или "2026-01-31T18:00"; дата без времени в конце периода — весь день целиком
+    moment = datetime.fromisoformat(value)
+    if end and len(value) <= 10:
+        moment += timedelta(days=1)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# === Что выгружать ===
+class ExportQuery:
+    def __init__(self, since=None, until=None, user_id=None, content_type=None):
+        self.since = since
+        self.until = until
+        self.user_id = user_id
+        self.content_type = content_type
+
+    def describe(self) -> str:
+        parts = []
+        if self.since:
+            parts.append(f"с {self.since}")
+        if self.until:
+            parts.append(f"до {self.until}")
+        if self.user_id is not None:
+            parts.append(f"пользователь {self.user_id}")
+        if self.content_type:
+            parts.append(f"тип {self.content_type}")
+        return ", ".join(parts) or "вся переписка"
+
+
+def parse_export_args(args: str):
+    # "csv from=2026-01-01 to=2026-01-31 user=123 type=photo" -> ("csv", ExportQuery)
+    fmt, query = 'jsonl', ExportQuery()
+    for part in (args or '').split():
+        key, _, value = part.partition('=')
+        try:
+            if not value and key in EXPORT_FORMATS:
+                fmt = key
+            elif key == 'from':
+                query.since = _parse_moment(value)
+            elif key == 'to':
+                query.until = _parse_moment(value, end=True)
+            elif key == 'user':
+                query.user_id = int(value)
+            elif key == 'type' and value:
+                query.content_type = value
+            else:
+                raise ValueError(part)
+        except ValueError:
+            raise ValueError(f"Непонятный параметр: {part}") from None
+    return fmt, query
+
+
+# === Запись частей архива ===
+class ExportWriter:
+    # Каждая часть — самостоятельный .gz (у CSV — со своим заголовком).
+    # Сжатые данные zlib отдаёт в файл блоками, поэтому новую часть начинаем с запасом до лимита.
+    def __init__(self, path, fmt='jsonl', part_size=None):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.part_size = part_size
+        self.margin = min(1024 * 1024, part_size // 10) if part_size else 0
+        self.paths = []
+        self.rows = 0
+        self._raw = None
+        self._gzip = None
+        self._text = None
+        self._csv = None
+
+    def _part_path(self, number):
+        # export.jsonl.gz -> export.part1.jsonl.gz
+        ext = next((e for e in (f'.{self.fmt}.gz', '.gz') if self.path.endswith(e)), '')
+        return f"{self.path[:len(self.path) - len(ext)]}.part{number}{ext}"
+
+    def _open_part(self):
+        path = self._part_path(len(self.paths) + 1)
+        self.paths.append(path)
+        self._raw = open(path, 'wb')
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=COMPRESS_LEVEL, mtime=0)
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8', newline='')
+        if self.fmt == 'csv':
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(COLUMNS)
+
+    def _close_part(self):
+        self._text.close()  # закрывает и GzipFile, но не сам файл
+        self._raw.close()
+        self._raw = self._gzip = self._text = self._csv = None
+
+    def write(self, rows):
+        for row in rows:
+            if self._raw is None:
+                self._open_part()
+            if self.fmt == 'csv':
+                self._csv.writerow(row)
+            else:
+                self._text.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+                self._text.write('\n')
+            self.rows += 1
+            if self.part_size and self._raw.tell() >= self.part_size - self.margin:
+                self._close_part()
+
+    def close(self) -> list:
+        if self._raw is None and not self.paths:
+            self._open_part()  # пустая выгрузка — пустой архив (для CSV — с заголовком)
+        if self._raw is not None:
+            self._close_part()
+        if len(self.paths) == 1:
+            os.replace(self.paths[0], self.path)
+            self.paths = [self.path]
+        return self.paths
+
+    def discard(self):
+        if self._raw is not None:
+            self._close_part()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.paths = []
+
+
+async def export_messages(storage, query: ExportQuery, path: str, fmt='jsonl', part_size=None, batch_size=500):
+    # Возвращает (пути частей, число строк). Сжатие идёт в потоке, чтобы не задерживать event loop.
+    writer = ExportWriter(path, fmt, part_size)
+    try:
+        batches = storage.export_messages(
+            since=query.since,
+            until=query.until,
+            user_id=query.user_id,
+            content_type=query.content_type,
+            batch_size=batch_size,
+        )
+        async with aclosing(batches):
+            async for rows in batches:
+                await asyncio.to_thread(writer.write, rows)
+        paths = await asyncio.to_thread(writer.close)
+    except BaseException:
+        writer.discard()
+        raise
+    return paths, writer.rows
+
+
+# === Командная строка ===
+# python export.py --format csv --from 2026-01-01 --to 2026-01-31 --output january.csv.gz
+# python export.py --database postgresql://bot@localhost/bot --user 123456 --type photo
+async def _run(args):
+    from storage import Storage
+
+    query = ExportQuery(
+        since=_parse_moment(args.since) if args.since else None,
+        until=_parse_moment(args.until, end=True) if args.until else None,
+        user_id=args.user,
+        content_type=args.type,
+    )
+    output = args.output or f"export.{args.format}.gz"
+    part_size = int(args.part_mb * 1024 * 1024) if args.part_mb else None
+    storage = Storage.from_url(args.database)
+    await storage.open()
+    try:
+        paths, rows = await export_messages(storage, query, output, args.format, part_size, args.batch_size)
+    finally:
+        await storage.close()
+    print(f"Выгружено сообщений: {rows} ({query.describe()})", file=sys.stderr)
+    for path in paths:
+        print(path)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Выгрузка переписки в gzip-сжатый JSONL или CSV")
+    parser.add_argument("--database", default=os.getenv("DATABASE_URL", "dialogs.db"))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    parser.add_argument("--from", dest="since", help="YYYY-MM-DD или YYYY-MM-DDTHH:MM, UTC")
+    parser.add_argument("--to", dest="until", help="включительно, если указана только дата")
+    parser.add_argument("--user", type=int)
+    parser.add_argument("--type", help="content_type: text, photo, voice, ...")
+    parser.add_argument("--output", help="по умолчанию export.<format>.gz")
+    parser.add_argument("--part-mb", type=float, help="резать архив на части не больше стольких МБ")
+    parser.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,63 @@
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+MESSAGE_LIMIT = 4096
+PAGE_ROWS = 50
+
+
+def text_length(text: str) -> int:
+    # Telegram считает длину в UTF-16 единицах
+    return len(text.encode('utf-16-le')) // 2
+
+
+def fit_text(text: str, limit: int) -> str:
+    text = text[:limit]
+    while text_length(text) > limit:
+        text = text[:-1]
+    return text
+
+
+def _format_row(row):
+    message_id, sender, _, content, ts, media_id = row
+    prefix = "👤" if sender == 'user' else "✅"
+    # Вложение можно получить заново командой /file_<id> — отправка по file_id, без пересылки
+    attachment = f" 📎 /file_{message_id}" if media_id else ""
+    return f"[{ts}] {prefix} {content}{attachment}\n"
+
+
+# === Страница истории переписки ===
+# Курсор — id сообщения: "n" — страница после него, "p" — перед ним.
+async def build_history_page(storage, user_id: int, after_id: int = None, before_id: int = None):
+    rows = await storage.get_history_page(user_id, after_id=after_id, before_id=before_id, limit=PAGE_ROWS)
+    if not rows:
+        return None, None
+
+    header = f"💬 История с пользователем {user_id}:\n\n"
+    budget = MESSAGE_LIMIT - text_length(header)
+
+    # Назад набираем страницу от курсора, то есть с конца
+    backward = before_id is not None
+    selected = []
+    for row in (reversed(rows) if backward else rows):
+        line = _format_row(row)
+        size = text_length(line)
+        if size > budget:
+            if selected:
+                break
+            line = fit_text(line, budget)
+            size = text_length(line)
+        selected.append((row[0], line))
+        budget -= size
+    if backward:
+        selected.reverse()
+
+    first_id, last_id = selected[0][0], selected[-1][0]
+    text = header + "".join(line for _, line in selected)
+
+    builder = InlineKeyboardBuilder()
+    if await storage.has_history_before(user_id, first_id):
+        builder.button(text="◀", callback_data=f"hist:{user_id}:p:{first_id}")
+    if await storage.has_history_after(user_id, last_id):
+        builder.button(text="▶", callback_data=f"hist:{user_id}:n:{last_id}")
+    builder.adjust(2)
+    keyboard = builder.as_markup() if any(builder.buttons) else None
+    return text, keyboard
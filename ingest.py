@@ -0,0 +1,91 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _consume_exception(future):
+    # Никто может не ждать результат — не засоряем лог "exception was never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+
+# === Очередь отложенной записи: пачка строк — одна транзакция ===
+# Строка попадает в базу не позже чем через max_delay_ms после постановки в очередь,
+# это и есть максимальное окно потерь при аварийном падении процесса.
+class IngestQueue:
+    def __init__(self, storage, batch_size=100, max_delay_ms=200, max_pending=10000):
+        self.storage = storage
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max(0, max_delay_ms) / 1000
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="ingest-queue")
+
+    async def stop(self):
+        # Дописываем всё, что уже в очереди, и только потом выходим
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    async def put(self, row, wait=False, outbox=None) -> asyncio.Future:
+        # wait=True — дождаться коммита пачки, в которую попала строка
+        # outbox — строка очереди отправки, коммитится вместе с сообщением
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        await self._queue.put((row, outbox, future))
+        if wait:
+            await future
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        rows = [row for row, _, _ in batch]
+        outbox = [entry for _, entry, _ in batch if entry is not None]
+        try:
+            await self.storage.save_messages(rows, outbox=outbox)
+        except Exception as e:
+            logger.exception("Не удалось записать пачку из %d сообщений", len(rows))
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
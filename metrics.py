@@ -0,0 +1,230 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# === Метрики в формате Prometheus ===
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._callbacks = {}
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+    def set_function(self, *labels, fn):
+        # Значение снимается в момент запроса /metrics
+        self._callbacks[labels] = fn
+
+    def samples(self):
+        values = dict(self._values)
+        for labels, fn in self._callbacks.items():
+            try:
+                values[labels] = fn()
+            except Exception:
+                logger.exception("Ошибка при чтении метрики %s", self.name)
+        for labels, value in values.items():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, *labels, value):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", "+Inf")])} {count}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {count}'
+
+
+# === Набор метрик бота ===
+class Metrics:
+    def __init__(self, slow_threshold_ms=None):
+        self.slow_threshold = slow_threshold_ms / 1000 if slow_threshold_ms else None
+        self._metrics = []
+
+        self.handler_seconds = self._add(Histogram(
+            'bot_handler_duration_seconds', 'Время работы обработчика', ('handler', 'content_type')))
+        self.handler_errors = self._add(Counter(
+            'bot_handler_errors_total', 'Исключения в обработчиках', ('handler',)))
+        self.db_seconds = self._add(Histogram(
+            'bot_db_duration_seconds', 'Время операций с базой', ('operation',)))
+        self.db_errors = self._add(Counter(
+            'bot_db_errors_total', 'Ошибки операций с базой', ('operation',)))
+        self.api_seconds = self._add(Histogram(
+            'bot_api_duration_seconds', 'Время запросов к Bot API', ('method',)))
+        self.api_errors = self._add(Counter(
+            'bot_api_errors_total', 'Ошибки запросов к Bot API', ('method', 'error')))
+        self.queue_depth = self._add(Gauge(
+            'bot_queue_depth', 'Длина внутренних очередей', ('queue',)))
+        self.outbox_dead = self._add(Counter(
+            'bot_outbox_dead_total', 'Сообщения, которые так и не удалось доставить'))
+        self.dropped_updates = self._add(Counter(
+            'bot_dropped_updates_total', 'Обновления, отброшенные антифлудом', ('content_type',)))
+        self.duplicate_updates = self._add(Counter(
+            'bot_duplicate_updates_total', 'Повторно доставленные обновления, пропущенные без обработки'))
+        self.startup_seconds = self._add(Gauge(
+            'bot_startup_seconds', 'Время от запуска процесса до готовности к приёму обновлений'))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def observe(self, histogram, *labels, seconds):
+        histogram.observe(*labels, value=seconds)
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            logger.warning("Медленная операция %s%s: %.0f мс", histogram.name, labels, seconds * 1000)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    # === Замер публичных async-методов объекта (хранилище и т.п.) ===
+    def instrument(self, obj, histogram, errors):
+        for name, method in inspect.getmembers(obj, inspect.iscoroutinefunction):
+            if name.startswith('_'):
+                continue
+            setattr(obj, name, self._timed(method, name, histogram, errors))
+        return obj
+
+    def _timed(self, method, name, histogram, errors):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                self.observe(histogram, name, seconds=time.perf_counter() - started)
+        return wrapper
+
+
+# === Замер обработчиков aiogram (inner middleware на message / callback_query) ===
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+        content_type = getattr(event, 'content_type', None) or type(event).__name__
+        content_type = getattr(content_type, 'value', content_type)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.handler_errors.inc(name)
+            raise
+        finally:
+            self.metrics.observe(self.metrics.handler_seconds, name, content_type,
+                                 seconds=time.perf_counter() - started)
+
+
+# === Замер запросов к Bot API (middleware сессии бота) ===
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.metrics.api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.metrics.observe(self.metrics.api_seconds, name, seconds=time.perf_counter() - started)
+
+
+# === HTTP /metrics ===
+def add_metrics_route(app, metrics):
+    from fastapi import Response
+
+    @app.get('/metrics')
+    async def prometheus_metrics():
+        return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def serve_metrics(metrics, host, port):
+    # Отдельный сервер для режима polling
+    import uvicorn
+    from fastapi import FastAPI
+
+    app = FastAPI()
+    add_metrics_route(app, metrics)
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level='warning'))
+    try:
+        await server.serve()
+    except asyncio.CancelledError:
+        server.should_exit = True
+        raise
@@ -0,0 +1,301 @@
+import logging
+import re
+
+from stats import backfill_stats
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def search_key(value):
+    return value.casefold() if value else None
+
+
+def ddl(tx, sql):
+    # Таблицы описаны в диалекте SQLite; для Postgres меняем типы.
+    # id Telegram не влезают в 32-битный INTEGER, время храним с точностью до секунды, как SQLite.
+    if tx.dialect != 'postgresql':
+        return sql
+    sql = sql.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'BIGSERIAL PRIMARY KEY')
+    sql = re.sub(r'\bINTEGER\b', 'BIGINT', sql)
+    return re.sub(r'\bDATETIME\b', 'TIMESTAMP(0)', sql)
+
+
+def migration(version, description):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+# === Миграции: каждая выполняется один раз, в своей транзакции ===
+@migration(1, "таблица messages")
+async def _create_messages(tx):
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        sender TEXT,
+        content_type TEXT,
+        content TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        first_name TEXT,
+        username TEXT
+    )
+    '''))
+
+    # Старые базы создавались без этих колонок (в Postgres таблица всегда новая)
+    if tx.dialect != 'sqlite':
+        return
+    columns = {row[1] for row in await tx.fetchall('PRAGMA table_info(messages)')}
+    for column in ('first_name', 'username'):
+        if column not in columns:
+            await tx.execute(f'ALTER TABLE messages ADD COLUMN {column} TEXT')
+
+
+@migration(2, "индексы messages")
+async def _index_messages(tx):
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)')
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_content_type ON messages (user_id, content_type)')
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+
+
+@migration(3, "таблица users")
+async def _create_users(tx):
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        username TEXT,
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_seen DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    '''))
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)')
+
+    # Заполняем по уже сохранённой переписке: имя берём из последнего сообщения
+    await tx.execute('''
+    INSERT INTO users (user_id, first_name, username, first_seen, last_seen)
+    SELECT m.user_id, m.first_name, m.username, agg.first_seen, agg.last_seen
+    FROM (
+        SELECT user_id, MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen, MAX(id) AS last_id
+        FROM messages
+        WHERE sender = 'user'
+        GROUP BY user_id
+    ) AS agg
+    JOIN messages AS m ON m.id = agg.last_id
+    WHERE true
+    ON CONFLICT (user_id) DO NOTHING
+    ''')
+
+
+@migration(4, "таблица sessions")
+async def _create_sessions(tx):
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        user_id INTEGER PRIMARY KEY,
+        mode TEXT NOT NULL DEFAULT 'idle',
+        target_user_id INTEGER,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    '''))
+
+
+@migration(5, "поиск и сортировка пользователей")
+async def _index_users(tx):
+    # Ключи поиска в нижнем регистре: NOCASE в SQLite не знает кириллицу
+    # В Postgres — побайтовое сравнение, иначе поиск по диапазону префикса зависит от локали
+    key_type = 'TEXT COLLATE "C"' if tx.dialect == 'postgresql' else 'TEXT'
+    await tx.execute(f'ALTER TABLE users ADD COLUMN name_key {key_type}')
+    await tx.execute(f'ALTER TABLE users ADD COLUMN username_key {key_type}')
+    rows = await tx.fetchall('SELECT user_id, first_name, username FROM users')
+    await tx.executemany(
+        'UPDATE users SET name_key = ?, username_key = ? WHERE user_id = ?',
+        [(search_key(first_name), search_key(username), user_id) for user_id, first_name, username in rows]
+    )
+    await tx.execute('DROP INDEX IF EXISTS idx_users_last_seen')
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen, user_id)')
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_users_name_key ON users (name_key)')
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_users_username_key ON users (username_key)')
+
+
+@migration(6, "закрепление диалогов за админами")
+async def _create_assignments(tx):
+    # Одна строка на пользователя: кто из админов ведёт диалог; closed_at IS NULL — диалог открыт
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS assignments (
+        user_id INTEGER PRIMARY KEY,
+        admin_id INTEGER NOT NULL,
+        assigned_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        closed_at DATETIME
+    )
+    '''))
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_assignments_admin ON assignments (admin_id, closed_at)')
+
+
+@migration(7, "полнотекстовый поиск по сообщениям")
+async def _create_messages_fts(tx):
+    if tx.dialect == 'postgresql':
+        # В Postgres вместо FTS5 — вычисляемый tsvector и GIN-индекс, триггеры не нужны
+        await tx.execute('''
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED
+        ''')
+        await tx.execute('CREATE INDEX IF NOT EXISTS idx_messages_fts ON messages USING GIN (content_tsv)')
+        return
+
+    # Индекс без копии текста (content='messages'), синхронизируется триггерами
+    await tx.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content,
+        content='messages',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''')
+    await tx.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    ''')
+    await tx.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    ''')
+    await tx.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    ''')
+    # Уже накопленная история индексируется одним проходом
+    await tx.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+@migration(8, "таблица media")
+async def _create_media(tx):
+    # Один файл — одна строка, даже если его присылали много раз (ключ — file_unique_id)
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS media (
+        file_unique_id TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        media_type TEXT NOT NULL,
+        file_size INTEGER,
+        mime_type TEXT,
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_seen DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    '''))
+    await tx.execute('ALTER TABLE messages ADD COLUMN media_id TEXT')
+    await tx.execute(
+        'CREATE INDEX IF NOT EXISTS idx_messages_media ON messages (media_id, user_id) WHERE media_id IS NOT NULL'
+    )
+
+
+@migration(9, "общее состояние воркеров")
+async def _create_state_kv(tx):
+    # Для STATE_URL=database: кэш сессий, счётчики и замки, общие для нескольких процессов
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS state_kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at INTEGER
+    )
+    '''))
+
+
+@migration(10, "очередь исходящих сообщений (outbox)")
+async def _create_outbox(tx):
+    # Что отправить в Telegram: пишется в одной транзакции с сообщением, отправляется воркерами.
+    # stream — порядок доставки: строки одного потока уходят строго по очереди.
+    # next_attempt_at — миллисекунды Unix; у строки в работе (sending) это конец аренды.
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        stream TEXT NOT NULL,
+        calls TEXT NOT NULL,
+        step INTEGER NOT NULL DEFAULT 0,
+        priority INTEGER NOT NULL DEFAULT 1,
+        notify_chat_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        delivered_at DATETIME
+    )
+    '''))
+    await tx.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at, id) "
+        "WHERE status IN ('pending', 'sending')"
+    )
+    await tx.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_stream ON outbox (stream, id) "
+        "WHERE status IN ('pending', 'sending')"
+    )
+    await tx.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_delivered ON outbox (delivered_at) WHERE status = 'delivered'"
+    )
+
+
+@migration(11, "счётчики статистики")
+async def _create_stats(tx):
+    # Счётчики обновляются вместе с записью сообщений: /stats не сканирует messages.
+    # period: '' — за всё время, 'YYYY-MM-DD' — день, 'YYYY-MM-DD HH' — час
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS stats (
+        period TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, metric, key)
+    )
+    '''))
+    # Пользователи, ждущие ответа на вопрос: время первого неотвеченного вопроса (секунды Unix)
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS open_questions (
+        user_id INTEGER PRIMARY KEY,
+        asked_at INTEGER NOT NULL
+    )
+    '''))
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_open_questions_asked ON open_questions (asked_at)')
+    await backfill_stats(tx)
+
+
+@migration(12, "обработанные обновления Telegram")
+async def _create_processed_updates(tx):
+    # update_id уже обработанных обновлений: повторная доставка пропускается; processed_at — секунды Unix
+    await tx.execute(ddl(tx, '''
+    CREATE TABLE IF NOT EXISTS processed_updates (
+        update_id INTEGER PRIMARY KEY,
+        processed_at INTEGER NOT NULL
+    )
+    '''))
+    await tx.execute('CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates (processed_at)')
+
+
+# === Запуск миграций ===
+MIGRATION_LOCK_ID = 7301  # pg_advisory_xact_lock: миграции нескольких экземпляров бота идут по очереди
+
+
+async def migrate(db):
+    await db.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+
+    for version, description, fn in MIGRATIONS:
+        async with db.transaction() as tx:
+            if tx.dialect == 'postgresql':
+                await tx.execute('SELECT pg_advisory_xact_lock(?)', (MIGRATION_LOCK_ID,))
+            # Проверяем внутри транзакции: другой процесс мог уже применить миграцию
+            row = await tx.fetchone('SELECT MAX(version) FROM schema_version')
+            if (row[0] or 0) >= version:
+                continue
+            await fn(tx)
+            await tx.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+        logger.info("Применена миграция %d: %s", version, description)
+
+    row = await db.fetchone('SELECT MAX(version) FROM schema_version')
+    return row[0] or 0
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from pydantic import BaseModel
+
+from sender import PRIORITY_NORMAL, send_priority
+
+logger = logging.getLogger(__name__)
+
+# Какие методы бота можно ставить в очередь
+OUTBOX_METHODS = frozenset({
+    'send_message', 'forward_message', 'forward_messages', 'copy_message', 'send_media_group',
+})
+
+
+def _dump(value):
+    # Клавиатуры и InputMedia — в обычные dict: при отправке aiogram соберёт их обратно.
+    # Default (parse_mode и т.п. по умолчанию бота) не пишем — подставится при отправке
+    if isinstance(value, BaseModel):
+        return {key: _dump(item) for key, item in value if item is not None and not isinstance(item, Default)}
+    if isinstance(value, (list, tuple)):
+        return [_dump(item) for item in value]
+    return value
+
+
+def api_call(method: str, **kwargs) -> list:
+    if method not in OUTBOX_METHODS:
+        raise ValueError(f"Метод {method} нельзя отправить через очередь")
+    return [method, {key: _dump(value) for key, value in kwargs.items() if value is not None}]
+
+
+def outbox_entry(key: str, stream: str, calls: list, priority=PRIORITY_NORMAL, notify_chat_id=None) -> tuple:
+    # key — ключ идемпотентности: повторная постановка с тем же ключом ничего не добавит.
+    # calls уходят по порядку; если упал третий, следующая попытка начнётся с третьего.
+    # notify_chat_id — кому сообщить, если доставить так и не удалось
+    return key, stream, json.dumps(calls, ensure_ascii=False, separators=(',', ':')), priority, notify_chat_id
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+# === Воркеры доставки ===
+# Один цикл берёт готовые строки из outbox (заодно записывая итоги прошлых доставок),
+# до workers доставок идут параллельно. Ошибка — повтор с экспоненциальной задержкой,
+# постоянная ошибка или max_attempts попыток — строка уходит в dead.
+class OutboxWorkers:
+    def __init__(self, storage, bot, workers=4, poll_interval=1.0, lease_seconds=60, max_attempts=8,
+                 backoff_base=2.0, backoff_max=600.0, keep_hours=24, metrics=None):
+        self.storage = storage
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.lease = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.keep_hours = keep_hours
+        self.metrics = metrics
+        self._wakeup = asyncio.Event()
+        self._inflight = set()
+        self._delivered = []
+        self._failed = []
+        self._task = None
+        self._stopping = False
+        self._drain_until = 0.0
+        self._purged_at = 0.0
+
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self, drain_seconds=5.0):
+        # Дослать то, что уже готово к отправке (не дольше drain_seconds), и записать итоги
+        if self._task is None:
+            return
+        self._stopping = True
+        self._drain_until = asyncio.get_running_loop().time() + drain_seconds
+        self.notify()
+        await self._task
+        self._task = None
+
+    def notify(self):
+        # Новые строки закоммичены — не ждём poll_interval
+        self._wakeup.set()
+
+    @property
+    def depth(self):
+        return len(self._inflight)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            delivered, self._delivered = self._delivered, []
+            failed, self._failed = self._failed, []
+            # stop() может прийти во время запроса к базе: весь проход смотрит на один снимок флага,
+            # иначе доставки прервались бы в самом начале отведённого на остановку времени
+            stopping = self._stopping
+            draining = stopping and loop.time() < self._drain_until
+            limit = self.workers - len(self._inflight) if not stopping or draining else 0
+            now = _now_ms()
+            try:
+                rows = await self.storage.outbox_cycle(delivered, failed, limit, now, now + self.lease * 1000)
+            except Exception:
+                logger.exception("Ошибка очереди отправки")
+                self._delivered[:0], self._failed[:0] = delivered, failed
+                rows = []
+                if stopping:
+                    break
+                await asyncio.sleep(self.poll_interval)
+                continue
+            for row in rows:
+                task = asyncio.create_task(self._deliver(*row))
+                self._inflight.add(task)
+                task.add_done_callback(self._done)
+            if stopping and not self._inflight and not rows:
+                break
+            if stopping and not draining and self._inflight:
+                # Время вышло: недоставленное бросаем, строки вернутся в работу по окончании аренды
+                logger.warning("Остановка: прервано доставок: %d", len(self._inflight))
+                for task in list(self._inflight):
+                    task.cancel()
+                await asyncio.gather(*self._inflight, return_exceptions=True)
+                continue
+            # Будит новая строка (notify) или завершённая доставка; при остановке — и конец отведённого времени
+            timeout = self.poll_interval
+            if stopping:
+                timeout = min(timeout, max(0.0, self._drain_until - loop.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            await self._maybe_purge(loop.time())
+
+    def _done(self, task):
+        self._inflight.discard(task)
+        self._wakeup.set()
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_base ** attempts, self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, outbox_id, calls, step, attempts, priority, notify_chat_id):
+        calls = json.loads(calls)
+        token = send_priority.set(priority)
+        try:
+            for index in range(step, len(calls)):
+                method, kwargs = calls[index]
+                await getattr(self.bot, method)(**kwargs)
+                step = index + 1
+        except asyncio.CancelledError:
+            # Прервано при остановке: запоминаем, сколько вызовов уже ушло, чтобы не отправить их повторно
+            self._failed.append(('pending', _now_ms(), step, 'cancelled', outbox_id))
+            raise
+        except TelegramRetryAfter as e:
+            self._retry(outbox_id, step, e, e.retry_after)
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            # Сообщение удалено, бот заблокирован и т.п. — повтор не поможет
+            await self._bury(outbox_id, step, e, attempts, notify_chat_id)
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                await self._bury(outbox_id, step, e, attempts, notify_chat_id)
+            else:
+                self._retry(outbox_id, step, e, self._backoff(attempts))
+        else:
+            self.delivered += 1
+            self._delivered.append(outbox_id)
+        finally:
+            send_priority.reset(token)
+
+    def _retry(self, outbox_id, step, error, delay):
+        self.retried += 1
+        logger.warning("Outbox %s: %s, повтор через %.1f с", outbox_id, error, delay)
+        self._failed.append(('pending', _now_ms() + int(delay * 1000), step, str(error)[:500], outbox_id))
+
+    async def _bury(self, outbox_id, step, error, attempts, notify_chat_id):
+        self.dead += 1
+        logger.error("Outbox %s: не доставлено после %d попыток: %s", outbox_id, attempts, error)
+        self._failed.append(('dead', 0, step, str(error)[:500], outbox_id))
+        if self.metrics is not None:
+            self.metrics.outbox_dead.inc()
+        if notify_chat_id is not None:
+            try:
+                await self.bot.send_message(notify_chat_id, f"❌ Сообщение не доставлено: {error}")
+            except Exception:
+                logger.exception("Не удалось сообщить о недоставленном сообщении %s", outbox_id)
+
+    async def _maybe_purge(self, now):
+        # Доставленные строки храним keep_hours ради ключей идемпотентности, потом удаляем порциями
+        if self._stopping or now - self._purged_at < 3600:
+            return
+        self._purged_at = now
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=self.keep_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            while await self.storage.purge_delivered_outbox(cutoff) > 0:
+                await asyncio.sleep(0.05)
+        except Exception:
+            logger.exception("Не удалось очистить доставленные строки outbox")
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def parse_content_type_days(value: str) -> dict:
+    # "sticker:1,voice:30" -> {"sticker": 1, "voice": 30}
+    result = {}
+    for part in (value or '').split(','):
+        if ':' in part:
+            content_type, days = part.split(':', 1)
+            result[content_type.strip()] = float(days)
+    return result
+
+
+def _cutoff(days) -> str:
+    # CURRENT_TIMESTAMP в SQLite — это UTC
+    moment = datetime.now(timezone.utc) - timedelta(days=days)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# === Политика хранения ===
+class RetentionPolicy:
+    def __init__(self, max_age_days=None, inactive_days=None, content_type_days=None):
+        self.max_age_days = max_age_days
+        self.inactive_days = inactive_days
+        self.content_type_days = content_type_days or {}
+
+
+# === Фоновая очистка старой переписки порциями ===
+class RetentionEngine:
+    def __init__(self, storage, policy, chunk_size=500, interval_hours=0, pause=0.05, reclaim_pages=2000):
+        self.storage = storage
+        self.policy = policy
+        self.chunk_size = chunk_size
+        self.interval = interval_hours * 3600
+        self.pause = pause
+        self.reclaim_pages = reclaim_pages
+        self.last_report = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._schedule(), name="retention")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _schedule(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                report = await self.run()
+                logger.info("Очистка по расписанию: %s", report)
+            except Exception:
+                logger.exception("Ошибка плановой очистки")
+
+    async def _drain(self, delete_chunk) -> int:
+        total = 0
+        while True:
+            deleted = await delete_chunk()
+            total += deleted
+            if deleted < self.chunk_size:
+                return total
+            # Даём пройти обычным записям между порциями
+            await asyncio.sleep(self.pause)
+
+    async def _finish(self, started, messages) -> dict:
+        users = 0
+        after = None
+        while True:
+            deleted, after = await self.storage.delete_orphan_users(after, limit=self.chunk_size)
+            users += deleted
+            if after is None:
+                break
+            await asyncio.sleep(self.pause)
+
+        # Файлы, на которые больше не ссылается ни одно сообщение
+        media = await self._drain(lambda: self.storage.delete_orphan_media(limit=self.chunk_size)) if messages else 0
+
+        pages = await self.storage.reclaim_space(self.reclaim_pages) if messages else 0
+        self.last_report = {
+            "messages": messages,
+            "users": users,
+            "media": media,
+            "pages_freed": pages,
+            "seconds": round(time.monotonic() - started, 2),
+        }
+        return self.last_report
+
+    async def run(self, policy: RetentionPolicy = None) -> dict:
+        policy = policy or self.policy
+        async with self._lock:
+            started = time.monotonic()
+            messages = 0
+            limit = self.chunk_size
+
+            if policy.max_age_days is not None:
+                # Типы со своим сроком чистим только по нему: он может быть и длиннее общего
+                cutoff = _cutoff(policy.max_age_days)
+                exclude = tuple(policy.content_type_days)
+                messages += await self._drain(
+                    lambda: self.storage.delete_messages_before(cutoff, exclude_types=exclude, limit=limit)
+                )
+
+            for content_type, days in policy.content_type_days.items():
+                cutoff = _cutoff(days)
+                messages += await self._drain(
+                    lambda: self.storage.delete_messages_before(cutoff, content_type=content_type, limit=limit)
+                )
+
+            if policy.inactive_days is not None:
+                cutoff = _cutoff(policy.inactive_days)
+                messages += await self._drain(lambda: self.storage.delete_messages_of_inactive_users(cutoff, limit=limit))
+
+            return await self._finish(started, messages)
+
+    async def clear_all(self) -> dict:
+        async with self._lock:
+            started = time.monotonic()
+            messages = await self._drain(lambda: self.storage.delete_all_messages(limit=self.chunk_size))
+            return await self._finish(started, messages)
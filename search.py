@@ -0,0 +1,82 @@
+import re
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from directory import CALLBACK_LIMIT, _fit_bytes
+from history import MESSAGE_LIMIT, fit_text, text_length
+
+PAGE_SIZE = 5
+MAX_OFFSET = 500
+SNIPPET_LIMIT = 300
+SNIPPET_BEFORE = 60
+
+
+def clamp_query(query: str) -> str:
+    # Запас под курсор: "srch:" + смещение + ":"
+    return _fit_bytes(' '.join((query or '').split()), CALLBACK_LIMIT - 12)
+
+
+def search_terms(query: str) -> list:
+    # Слова запроса без обрамляющих кавычек; синтаксис полнотекстового индекса строит хранилище
+    return [term for term in (part.strip('"') for part in query.split()) if term]
+
+
+def make_snippet(content: str, terms: list) -> str:
+    # Фрагмент вокруг первого совпадения, найденные слова в «». Считаем здесь, а не через
+    # snippet() в SQL: там для каждой строки страницы заново разбирается весь MATCH.
+    pattern = re.compile('|'.join(r'(?<!\w)' + re.escape(term) + r'\w*' for term in terms), re.IGNORECASE)
+    found = pattern.search(content)
+    start = max(found.start() - SNIPPET_BEFORE, 0) if found else 0
+    fragment = fit_text(content[start:], SNIPPET_LIMIT)
+    end = start + len(fragment)
+    fragment = pattern.sub(lambda m: f"«{m.group(0)}»", fragment)
+    return ("…" if start else "") + fragment + ("…" if end < len(content) else "")
+
+
+def parse_callback(data: str):
+    # srch:<offset>:<query>
+    _, offset, query = data.split(':', 2)
+    return query, int(offset)
+
+
+# === Страница результатов поиска по переписке ===
+async def build_search_page(storage, query: str, offset: int = 0, candidates: int = 1000):
+    query = clamp_query(query)
+    terms = search_terms(query)
+    if not terms:
+        return "❌ Используй: /search <слова>", None
+    offset = min(max(offset, 0), MAX_OFFSET)
+
+    rows = await storage.search_messages(terms, limit=PAGE_SIZE + 1, offset=offset, candidates=candidates)
+    has_more = len(rows) > PAGE_SIZE and offset + PAGE_SIZE <= MAX_OFFSET
+    rows = rows[:PAGE_SIZE]
+
+    if not rows:
+        if offset == 0:
+            return f"❌ По запросу «{query}» ничего не найдено.", None
+        return None, None
+
+    text = f"🔎 Поиск «{query}», результаты {offset + 1}–{offset + len(rows)}:\n\n"
+    builder = InlineKeyboardBuilder()
+    for message_id, user_id, first_name, username, ts, content in rows:
+        name = first_name or "Неизвестный"
+        uname = f" (@{username})" if username else ""
+        entry = f"👤 {name}{uname}, id {user_id} — {ts}\n{make_snippet(content or '', terms)}\n\n"
+        if text_length(text) + text_length(entry) > MESSAGE_LIMIT:
+            break
+        text += entry
+        builder.button(text=f"💬 {name}", callback_data=f"reply_{user_id}")
+        # Страница истории, начинающаяся с найденного сообщения
+        builder.button(text="🗂 В истории", callback_data=f"hist:{user_id}:n:{message_id - 1}")
+
+    text = text.rstrip()
+
+    nav = 0
+    if offset > 0:
+        builder.button(text="◀", callback_data=f"srch:{max(offset - PAGE_SIZE, 0)}:{query}")
+        nav += 1
+    if has_more:
+        builder.button(text="▶", callback_data=f"srch:{offset + PAGE_SIZE}:{query}")
+        nav += 1
+    builder.adjust(*([2] * len(rows)), *([nav] if nav else []))
+    return text, builder.as_markup()
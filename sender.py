@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import itertools
+import logging
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем раньше уходит запрос
+PRIORITY_REPLY = 0
+PRIORITY_NORMAL = 1
+
+send_priority = ContextVar("send_priority", default=PRIORITY_NORMAL)
+
+
+# === Корзина токенов ===
+class TokenBucket:
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now) -> float:
+        # Сколько секунд ждать до следующего токена (0 — можно отправлять)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0
+
+    def idle(self, now) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+# === Планировщик исходящих запросов к Bot API ===
+# Общий лимит на бота + лимит на каждый чат, при 429 ждём retry_after и повторяем.
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3, max_chats=10000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global = None
+        self._chats = OrderedDict()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+        self.sent = 0
+        self.retries = 0
+        self.waited_total = 0.0
+        self.waited_max = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        attempt = 0
+        while True:
+            await self.acquire(chat_id, send_priority.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                logger.warning("429 в чате %s, повтор через %s с", chat_id, e.retry_after)
+                self._chat_bucket(chat_id, self._now()).block(self._now() + e.retry_after)
+
+    def _now(self):
+        return asyncio.get_running_loop().time()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            if len(self._chats) > self.max_chats:
+                self._evict(now)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _evict(self, now):
+        # Забываем только полностью восстановившиеся корзины — они ничего не ограничивают
+        for chat_id in list(self._chats):
+            if len(self._chats) <= self.max_chats:
+                break
+            if self._chats[chat_id].idle(now):
+                del self._chats[chat_id]
+
+    async def acquire(self, chat_id, priority=PRIORITY_NORMAL):
+        loop = asyncio.get_running_loop()
+        if self._global is None:
+            self._global = TokenBucket(self.global_rate, self.global_rate, loop.time())
+        future = loop.create_future()
+        started = loop.time()
+        bisect.insort(self._waiters, (priority, next(self._seq), chat_id, future))
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump(), name="send-scheduler")
+        await future
+
+        waited = loop.time() - started
+        self.sent += 1
+        self.waited_total += waited
+        self.waited_max = max(self.waited_max, waited)
+
+    async def _pump(self):
+        while self._waiters:
+            self._wakeup.clear()
+            now = self._now()
+            timeout = self._global.delay(now)
+            if timeout <= 0:
+                timeout = None
+                for i, (_, _, chat_id, future) in enumerate(self._waiters):
+                    if future.done():
+                        continue
+                    delay = self._chat_bucket(chat_id, now).delay(now)
+                    if delay <= 0:
+                        self._chats[chat_id].consume(now)
+                        self._global.consume(now)
+                        del self._waiters[i]
+                        future.set_result(None)
+                        break
+                    timeout = delay if timeout is None else min(timeout, delay)
+                else:
+                    self._waiters = [w for w in self._waiters if not w[3].done()]
+                    if not self._waiters:
+                        break
+                    await self._sleep(timeout)
+                continue
+            await self._sleep(timeout)
+
+    async def _sleep(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> dict:
+        by_priority = {}
+        for priority, _, _, future in self._waiters:
+            if not future.done():
+                by_priority[priority] = by_priority.get(priority, 0) + 1
+        return {
+            "queue_depth": sum(by_priority.values()),
+            "queue_by_priority": by_priority,
+            "sent": self.sent,
+            "retries": self.retries,
+            "wait_avg_ms": round(self.waited_total / self.sent * 1000, 1) if self.sent else 0.0,
+            "wait_max_ms": round(self.waited_max * 1000, 1),
+        }
+
+
+# === Запросы, сделанные при обработке сообщений админа, идут вне очереди ===
+class SendPriorityMiddleware(BaseMiddleware):
+    def __init__(self, admin_ids):
+        self.admin_ids = set(admin_ids)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id not in self.admin_ids:
+            return await handler(event, data)
+        token = send_priority.set(PRIORITY_REPLY)
+        try:
+            return await handler(event, data)
+        finally:
+            send_priority.reset(token)
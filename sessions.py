@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+
+MODE_IDLE = 'idle'
+MODE_APPLICATION = 'application'
+MODE_QUESTION = 'question'
+
+_MISSING = object()
+
+
+# === Ограниченный LRU-кэш с временем жизни записей ===
+class LRUCache:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# === Состояние диалога: режим пользователя и активный собеседник админа ===
+# Хранится в базе, читается через общее состояние (state.py): в памяти процесса
+# или в Redis/таблице, если воркеров несколько — тогда все видят одни и те же режимы.
+class SessionStore:
+    def __init__(self, storage, state, ttl=3600):
+        self.storage = storage
+        self.state = state
+        self.ttl = ttl
+
+    async def _get(self, user_id):
+        session = await self.state.get(f"session:{user_id}")
+        if session is None:
+            row = await self.storage.get_session(user_id)
+            session = (row[0], row[1]) if row else (MODE_IDLE, None)
+            await self.state.set(f"session:{user_id}", list(session), ttl=self.ttl)
+        return tuple(session)
+
+    async def _set(self, user_id, mode, target_user_id):
+        await self.storage.save_session(user_id, mode, target_user_id)
+        await self.state.set(f"session:{user_id}", [mode, target_user_id], ttl=self.ttl)
+
+    # === Режим пользователя ===
+    async def get_mode(self, user_id: int) -> str:
+        mode, _ = await self._get(user_id)
+        return mode
+
+    async def set_mode(self, user_id: int, mode: str):
+        _, target_user_id = await self._get(user_id)
+        await self._set(user_id, mode, target_user_id)
+
+    # === Собеседник администратора ===
+    async def get_target(self, admin_id: int):
+        _, target_user_id = await self._get(admin_id)
+        return target_user_id
+
+    async def set_target(self, admin_id: int, target_user_id):
+        mode, _ = await self._get(admin_id)
+        await self._set(admin_id, mode, target_user_id)
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+
+from aiogram import BaseMiddleware
+
+from sessions import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+# === Общее состояние бота: кэш сессий, закрепления, счётчики и замки по ключу ===
+# Значения — всё, что сериализуется в JSON. Замок «честный»: кто раньше встал в очередь,
+# тот раньше входит, поэтому обновления одного чата обрабатываются по порядку прихода.
+class BaseState(ABC):
+    shared = True
+
+    def __init__(self, lock_ttl=30.0, poll_min=0.005, poll_max=0.1, lock_grace=1.0):
+        self.lock_ttl = lock_ttl
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.lock_grace = lock_grace
+
+    @abstractmethod
+    async def get(self, key):
+        ...
+
+    @abstractmethod
+    async def set(self, key, value, ttl=None):
+        ...
+
+    @abstractmethod
+    async def delete(self, key):
+        ...
+
+    @abstractmethod
+    async def incr(self, key, amount=1, ttl=None) -> int:
+        ...
+
+    async def close(self):
+        pass
+
+    @asynccontextmanager
+    async def lock(self, key, timeout=None):
+        # Билетный замок поверх incr/get/set: билет берётся атомарно, входим, когда отпущены все предыдущие.
+        # Каждый билет по выходе помечается: done — отработал, skipped — ушёл, не войдя (отмена, ошибка).
+        # Пометки только добавляются, поэтому опоздавший владелец не может откатить очередь назад.
+        # Владелец держит замок не дольше timeout, потом его обработчик отменяется; ждущий входит без
+        # пометки предыдущего, только если очередь не двигалась timeout + lock_grace (упал процесс).
+        timeout = timeout or self.lock_ttl
+        keep = max(timeout * 10, 3600)
+        ticket = await self.incr(f"{key}:ticket", ttl=keep)
+        outcome = 'skipped'
+        try:
+            await self._wait_turn(key, ticket, timeout)
+            outcome = 'done'
+            await self.set(f"{key}:entered", ticket, ttl=keep)
+            lease = asyncio.timeout(timeout)
+            try:
+                async with lease:
+                    yield
+            except TimeoutError:
+                if lease.expired():
+                    logger.warning("Замок %s: владелец не уложился в %s с и отменён", key, timeout)
+                raise
+        finally:
+            # Пометки живут меньше счётчика билетов: после его сброса старые пометки не спутать с новыми
+            await self.set(f"{key}:done:{ticket}", outcome, ttl=keep / 2)
+
+    async def _wait_turn(self, key, ticket, timeout):
+        loop = asyncio.get_running_loop()
+        previous = ticket - 1
+        seen = None
+        deadline = loop.time() + timeout + self.lock_grace
+        delay = self.poll_min
+        while previous > 0:
+            mark = await self.get(f"{key}:done:{previous}")
+            if mark == 'done':
+                return
+            if mark == 'skipped':
+                # Этот билет так и не вошёл — ждём того, кто перед ним
+                previous -= 1
+                continue
+            entered = await self.get(f"{key}:entered")
+            if entered != seen:
+                # Вошёл следующий владелец — отсчитываем его срок заново
+                seen = entered
+                deadline = loop.time() + timeout + self.lock_grace
+            elif loop.time() >= deadline:
+                logger.warning("Замок %s: очередь стоит дольше %s с, продолжаем без билета %s", key, timeout, previous)
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max)
+
+
+# === В памяти процесса: один воркер, как было раньше ===
+class MemoryState(BaseState):
+    shared = False
+
+    def __init__(self, maxsize=10000, ttl=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._pinned = {}
+        self._locks = {}
+
+    async def get(self, key):
+        if key in self._pinned:
+            return self._pinned[key]
+        return self.cache.get(key)
+
+    async def set(self, key, value, ttl=None):
+        # Без ttl — бессрочно, как в Redis и в базе: такие значения (счётчики, активность админов)
+        # не вытесняются из LRU и не истекают через срок жизни кэша
+        self._pinned.pop(key, None)
+        self.cache.pop(key)
+        if ttl is None:
+            self._pinned[key] = value
+        else:
+            self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key):
+        self._pinned.pop(key, None)
+        self.cache.pop(key)
+
+    async def incr(self, key, amount=1, ttl=None) -> int:
+        value = (await self.get(key) or 0) + amount
+        await self.set(key, value, ttl=ttl)
+        return value
+
+    @asynccontextmanager
+    async def lock(self, key, timeout=None):
+        # asyncio.Lock сам пропускает ожидающих по очереди; пустые замки сразу удаляем
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+# === В таблице базы (SQLite или Postgres): несколько воркеров с общей базой ===
+class DatabaseState(BaseState):
+    PURGE_EVERY = 1000
+
+    def __init__(self, database, **kwargs):
+        super().__init__(**kwargs)
+        self.db = database
+        self._writes = 0
+
+    @staticmethod
+    def _expires(ttl):
+        return int((time.time() + ttl) * 1000) if ttl else None
+
+    async def get(self, key):
+        row = await self.db.fetchone(
+            'SELECT value FROM state_kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, int(time.time() * 1000))
+        )
+        return json.loads(row[0]) if row else None
+
+    async def set(self, key, value, ttl=None):
+        await self.db.execute('''
+            INSERT INTO state_kv (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+        ''', (key, json.dumps(value), self._expires(ttl)))
+        await self._maybe_purge()
+
+    async def delete(self, key):
+        await self.db.execute('DELETE FROM state_kv WHERE key = ?', (key,))
+
+    async def incr(self, key, amount=1, ttl=None) -> int:
+        now = int(time.time() * 1000)
+        async with self.db.transaction() as tx:
+            row = await tx.fetchone('''
+                INSERT INTO state_kv (key, value, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = CAST(
+                        CASE WHEN state_kv.expires_at IS NOT NULL AND state_kv.expires_at <= ? THEN 0
+                             ELSE CAST(state_kv.value AS BIGINT) END + ? AS TEXT),
+                    expires_at = excluded.expires_at
+                RETURNING value
+            ''', (key, str(amount), self._expires(ttl), now, amount))
+        await self._maybe_purge()
+        return int(row[0])
+
+    async def _maybe_purge(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            await self.db.execute('DELETE FROM state_kv WHERE expires_at <= ?', (int(time.time() * 1000),))
+
+
+# === Redis (или любой сервер с его протоколом) ===
+class RedisState(BaseState):
+    def __init__(self, url=None, client=None, prefix="linxy:", **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            import redis.asyncio as redis  # нужен только для STATE_URL=redis://...
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, value, ttl=None):
+        await self.client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+    async def incr(self, key, amount=1, ttl=None) -> int:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incrby(self.prefix + key, amount)
+            if ttl:
+                pipe.pexpire(self.prefix + key, int(ttl * 1000))
+            result = await pipe.execute()
+        return int(result[0])
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def open_state(url, database=None, cache_size=10000, ttl=3600, lock_ttl=30.0):
+    # memory (по умолчанию), database — таблица state_kv в основной базе, redis://host:6379/0
+    url = url or "memory"
+    if url == "memory":
+        return MemoryState(maxsize=cache_size, ttl=ttl, lock_ttl=lock_ttl)
+    if url == "database":
+        return DatabaseState(database, lock_ttl=lock_ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url, lock_ttl=lock_ttl)
+    raise ValueError(f"Неподдерживаемый STATE_URL: {url}")
+
+
+# === Обновления одного чата — по одному и по порядку, даже если воркеров несколько ===
+class ChatOrderMiddleware(BaseMiddleware):
+    def __init__(self, state, timeout=None):
+        self.state = state
+        self.timeout = timeout
+
+    async def __call__(self, handler, event, data):
+        chat = data.get('event_chat')
+        user = data.get('event_from_user')
+        key = chat.id if chat is not None else (user.id if user is not None else None)
+        if key is None:
+            return await handler(event, data)
+        async with self.state.lock(f"chat:{key}", timeout=self.timeout):
+            return await handler(event, data)
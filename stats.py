@@ -0,0 +1,145 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from history import MESSAGE_LIMIT, fit_text
+
+# period: '' — за всё время, 'YYYY-MM-DD' — день, 'YYYY-MM-DD HH' — час (UTC, как timestamp в messages)
+TOTAL = ''
+# Метрики, которые можно пересчитать по messages; время ответа в истории не хранится
+HISTORY_METRICS = ('messages', 'content_type', 'vacancy')
+REPORT_DAYS = 7
+
+
+def _day(now: datetime) -> str:
+    return now.strftime('%Y-%m-%d')
+
+
+def _hour(now: datetime) -> str:
+    return now.strftime('%Y-%m-%d %H')
+
+
+def message_counters(rows, now: datetime) -> list:
+    # rows — строки save_messages -> [(period, metric, key, value)], отсортированы:
+    # в Postgres параллельные пачки обновляют строки в одном порядке и не ловят взаимоблокировку
+    counts = Counter()
+    for row in rows:
+        content_type = row[2] or ''
+        counts['messages', ''] += 1
+        counts['content_type', content_type] += 1
+        if content_type == 'application':
+            counts['vacancy', row[3] or ''] += 1
+    day = _day(now)
+    result = [(_hour(now), 'messages', '', counts['messages', ''])]
+    for (metric, key), value in counts.items():
+        result.append((TOTAL, metric, key, value))
+        result.append((day, metric, key, value))
+    return sorted(result)
+
+
+def reply_counters(seconds: int, now: datetime) -> list:
+    # Первый ответ админа на вопрос: число ответов и сумма ожидания в секундах
+    return sorted(
+        (period, 'first_reply', key, value)
+        for period in (TOTAL, _day(now))
+        for key, value in (('count', 1), ('seconds', seconds))
+    )
+
+
+async def backfill_stats(tx):
+    # Пересчёт счётчиков по сохранённой истории (миграция и /stats rebuild).
+    # Удалённое очисткой в пересчёт не попадёт: счётчики "за всё время" станут меньше.
+    if tx.dialect == 'postgresql':
+        # Пачки сообщений ждут конца пересчёта, иначе их прибавка посчиталась бы дважды
+        await tx.execute('LOCK TABLE stats IN EXCLUSIVE MODE')
+        day, hour = "to_char(timestamp, 'YYYY-MM-DD')", "to_char(timestamp, 'YYYY-MM-DD HH24')"
+    else:
+        day, hour = 'substr(timestamp, 1, 10)', 'substr(timestamp, 1, 13)'
+    await tx.execute(
+        f"DELETE FROM stats WHERE metric IN ({', '.join('?' * len(HISTORY_METRICS))})", HISTORY_METRICS)
+    queries = [(hour, "'messages'", "''", 'true')]
+    for period in ("''", day):
+        queries += [
+            (period, "'messages'", "''", 'true'),
+            (period, "'content_type'", "COALESCE(content_type, '')", 'true'),
+            (period, "'vacancy'", "COALESCE(content, '')", "content_type = 'application'"),
+        ]
+    for period, metric, key, condition in queries:
+        await tx.execute(f'''
+            INSERT INTO stats (period, metric, key, value)
+            SELECT {period}, {metric}, {key}, COUNT(*) FROM messages
+            WHERE timestamp IS NOT NULL AND {condition}
+            GROUP BY 1, 2, 3
+        ''')
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    return f"{seconds // 86400} дн. {seconds % 86400 // 3600} ч"
+
+
+def _average(stats, period_filter):
+    count = sum(value for (period, key), value in stats.items() if key == 'count' and period_filter(period))
+    seconds = sum(value for (period, key), value in stats.items() if key == 'seconds' and period_filter(period))
+    return (format_duration(seconds / count), count) if count else ("—", 0)
+
+
+# === Отчёт /stats: читаются только счётчики за последние days дней, messages не сканируется ===
+async def build_stats_report(storage, days: int = REPORT_DAYS, now: datetime = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    today = _day(now)
+    since = _day(now - timedelta(days=days - 1))
+    counters = {}
+    for period, metric, key, value in await storage.get_stats(since):
+        counters.setdefault(metric, {})[period, key] = value
+
+    def split(metric):
+        # key -> (за days дней, всего)
+        result = {}
+        for (period, key), value in counters.get(metric, {}).items():
+            recent, total = result.get(key, (0, 0))
+            if period == TOTAL:
+                total += value
+            elif len(period) == len(today):
+                recent += value
+            result[key] = (recent, total)
+        return sorted(result.items(), key=lambda item: (-item[1][0], -item[1][1], item[0]))
+
+    messages = counters.get('messages', {})
+    lines = [
+        "📊 Статистика (время UTC)",
+        "",
+        f"✉️ Сообщений: сегодня {messages.get((today, ''), 0)}, "
+        f"за {days} дн. {sum(value for (period, _), value in messages.items() if len(period) == len(today))}, "
+        f"всего {messages.get((TOTAL, ''), 0)}",
+    ]
+    hours = sorted((period[-2:], value) for (period, _), value in messages.items() if period.startswith(today + ' '))
+    if hours:
+        lines.append("🕐 Сегодня по часам: " + ", ".join(f"{hour}ч — {value}" for hour, value in hours))
+
+    for metric, title in (('vacancy', "👥 Заявки по вакансиям"), ('content_type', "📎 Типы сообщений")):
+        rows = split(metric)
+        if rows:
+            lines += ["", f"{title} ({days} дн. / всего):"]
+            lines += [f"• {key or '—'}: {recent} / {total}" for key, (recent, total) in rows]
+
+    waiting, oldest = await storage.open_questions_summary()
+    lines.append("")
+    if waiting:
+        age = format_duration(now.timestamp() - oldest)
+        lines.append(f"❓ Вопросов без ответа: {waiting}, дольше всех ждёт {age}")
+    else:
+        lines.append("❓ Вопросов без ответа нет")
+    replies = counters.get('first_reply', {})
+    recent, recent_count = _average(replies, lambda period: period != TOTAL)
+    total, total_count = _average(replies, lambda period: period == TOTAL)
+    lines.append(
+        f"⏱ Первый ответ на вопрос: за {days} дн. в среднем {recent} ({recent_count}), "
+        f"за всё время {total} ({total_count})"
+    )
+    return fit_text("\n".join(lines), MESSAGE_LIMIT)
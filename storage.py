@@ -0,0 +1,470 @@
+from datetime import datetime, timezone
+
+from database import SqliteDatabase, open_database
+from migrations import migrate, search_key
+from stats import backfill_stats, message_counters, reply_counters
+
+_INSERT_MESSAGE = '''
+    INSERT INTO messages (user_id, sender, content_type, content, first_name, username, media_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+_UPSERT_MEDIA = '''
+    INSERT INTO media (file_unique_id, file_id, media_type, file_size, mime_type, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (file_unique_id) DO UPDATE SET
+        file_id = excluded.file_id,
+        file_size = COALESCE(excluded.file_size, media.file_size),
+        mime_type = COALESCE(excluded.mime_type, media.mime_type),
+        last_seen = excluded.last_seen
+'''
+
+_UPSERT_USER = '''
+    INSERT INTO users (user_id, first_name, username, name_key, username_key, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE SET
+        first_name = COALESCE(excluded.first_name, users.first_name),
+        username = excluded.username,
+        name_key = COALESCE(excluded.name_key, users.name_key),
+        username_key = excluded.username_key,
+        last_seen = excluded.last_seen
+'''
+
+_ADD_STATS = '''
+    INSERT INTO stats (period, metric, key, value) VALUES (?, ?, ?, ?)
+    ON CONFLICT (period, metric, key) DO UPDATE SET value = stats.value + excluded.value
+'''
+
+_OPEN_QUESTION = '''
+    INSERT INTO open_questions (user_id, asked_at) VALUES (?, ?)
+    ON CONFLICT (user_id) DO NOTHING
+'''
+
+_INSERT_OUTBOX = '''
+    INSERT INTO outbox (idempotency_key, stream, calls, priority, notify_chat_id)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (idempotency_key) DO NOTHING
+'''
+
+# Голова каждого потока, у которой подошло время; у Postgres строки, взятые другим процессом, пропускаем
+_CLAIM_OUTBOX = '''
+    UPDATE outbox SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?
+    WHERE id IN (
+        SELECT o.id FROM outbox AS o
+        WHERE o.status IN ('pending', 'sending') AND o.next_attempt_at <= ?
+          AND NOT EXISTS (
+              SELECT 1 FROM outbox AS p
+              WHERE p.stream = o.stream AND p.id < o.id AND p.status IN ('pending', 'sending')
+          )
+        ORDER BY o.id
+        LIMIT ?
+        {lock}
+    )
+    RETURNING id, calls, step, attempts, priority, notify_chat_id
+'''
+
+
+# === Репозиторий сообщений ===
+class Storage:
+    def __init__(self, database):
+        self.db = database
+        self.schema_version = 0
+
+    @classmethod
+    def from_path(cls, path, read_pool_size=4):
+        return cls(SqliteDatabase(path, read_pool_size=read_pool_size))
+
+    @classmethod
+    def from_url(cls, url, read_pool_size=4, pool_size=10):
+        return cls(open_database(url, read_pool_size=read_pool_size, pool_size=pool_size))
+
+    async def open(self):
+        await self.db.connect()
+        self.schema_version = await migrate(self.db)
+
+    async def close(self):
+        await self.db.close()
+
+    # === Сообщения ===
+    async def save_message(self, user_id: int, sender: str, content_type: str, content: str,
+                           first_name: str = None, username: str = None):
+        await self.save_messages([(user_id, sender, content_type, content, first_name, username)])
+
+    async def save_messages(self, rows, outbox=()):
+        # rows: (user_id, sender, content_type, content, first_name, username[, media])
+        # media — (file_unique_id, file_id, media_type, file_size, mime_type) или None
+        # outbox — строки очереди отправки (см. outbox.outbox_entry), пишутся в той же транзакции
+        messages, media = [], {}
+        for row in rows:
+            info = row[6] if len(row) > 6 else None
+            if info is not None:
+                media[info[0]] = info
+            messages.append((*row[:6], info[0] if info is not None else None))
+        users = {
+            row[0]: (row[0], row[4], row[5], search_key(row[4]), search_key(row[5]))
+            for row in messages if row[1] == 'user'
+        }
+        # Счётчики /stats и ожидающие ответа вопросы — в той же транзакции, что и сами сообщения
+        now = datetime.now(timezone.utc)
+        questions = {row[0]: (row[0], int(now.timestamp())) for row in messages if row[2] == 'question'}
+        statements = [
+            (_UPSERT_MEDIA, list(media.values())),
+            (_INSERT_MESSAGE, messages),
+            (_UPSERT_USER, list(users.values())),
+            (_ADD_STATS, message_counters(messages, now)),
+            (_OPEN_QUESTION, list(questions.values())),
+        ]
+        if outbox:
+            statements.append((_INSERT_OUTBOX, list(outbox)))
+        await self.db.execute_batch(statements)
+
+    async def get_history_page(self, user_id: int, after_id: int = None, before_id: int = None, limit: int = 50) -> list:
+        # Keyset-пагинация по индексу (user_id, id); строки всегда по возрастанию id
+        if before_id is not None:
+            rows = await self.db.fetchall('''
+                SELECT id, sender, content_type, content, timestamp, media_id FROM messages
+                WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+            ''', (user_id, before_id, limit))
+            rows.reverse()
+            return rows
+        return await self.db.fetchall('''
+            SELECT id, sender, content_type, content, timestamp, media_id FROM messages
+            WHERE user_id = ? AND id > ? ORDER BY id ASC LIMIT ?
+        ''', (user_id, after_id or 0, limit))
+
+    async def has_history_before(self, user_id: int, message_id: int) -> bool:
+        row = await self.db.fetchone('SELECT 1 FROM messages WHERE user_id = ? AND id < ? LIMIT 1', (user_id, message_id))
+        return row is not None
+
+    async def has_history_after(self, user_id: int, message_id: int) -> bool:
+        row = await self.db.fetchone('SELECT 1 FROM messages WHERE user_id = ? AND id > ? LIMIT 1', (user_id, message_id))
+        return row is not None
+
+    # === Вложения ===
+    async def get_message_media(self, message_id: int):
+        # (user_id, media_type, file_id, content) для сообщения с вложением
+        return await self.db.fetchone('''
+            SELECT m.user_id, md.media_type, md.file_id, m.content
+            FROM messages AS m
+            JOIN media AS md ON md.file_unique_id = m.media_id
+            WHERE m.id = ?
+        ''', (message_id,))
+
+    async def media_usage(self, user_id: int = None, limit: int = 10) -> list:
+        # (user_id, файлов, байт); один файл, присланный повторно, считается один раз
+        where = 'AND user_id = ?' if user_id is not None else ''
+        params = (user_id, limit) if user_id is not None else (limit,)
+        return await self.db.fetchall(f'''
+            SELECT um.user_id, COUNT(*), CAST(COALESCE(SUM(md.file_size), 0) AS BIGINT)
+            FROM (
+                SELECT DISTINCT media_id, user_id FROM messages
+                WHERE media_id IS NOT NULL {where}
+            ) AS um
+            JOIN media AS md ON md.file_unique_id = um.media_id
+            GROUP BY um.user_id
+            ORDER BY 3 DESC
+            LIMIT ?
+        ''', params)
+
+    async def media_totals(self):
+        # (файлов, байт) по всей таблице media
+        return await self.db.fetchone('SELECT COUNT(*), CAST(COALESCE(SUM(file_size), 0) AS BIGINT) FROM media')
+
+    # === Выгрузка переписки ===
+    def export_messages(self, since: str = None, until: str = None, user_id: int = None,
+                        content_type: str = None, batch_size: int = 500):
+        # Асинхронный генератор порций строк:
+        # (id, timestamp, user_id, first_name, username, sender, content_type, content, media_type, file_id)
+        # since включительно, until не включительно — строки "YYYY-MM-DD HH:MM:SS" в UTC
+        conditions, params = [], []
+        for condition, value in (('m.timestamp >= ?', since), ('m.timestamp < ?', until),
+                                 ('m.user_id = ?', user_id), ('m.content_type = ?', content_type)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return self.db.iterate(f'''
+            SELECT m.id, m.timestamp, m.user_id, m.first_name, m.username, m.sender,
+                   m.content_type, m.content, md.media_type, md.file_id
+            FROM messages AS m
+            LEFT JOIN media AS md ON md.file_unique_id = m.media_id
+            {where}
+            ORDER BY m.id
+        ''', tuple(params), batch_size=batch_size)
+
+    # === Полнотекстовый поиск ===
+    async def search_messages(self, terms: list, limit: int = 5, offset: int = 0, candidates: int = 1000) -> list:
+        # Все слова обязательны, каждое ищется как префикс. Ранжируем только последние candidates
+        # совпадений: обход индекса по id с LIMIT дешёвый, а ранжирование всех совпадений частого слова — нет.
+        if self.db.dialect == 'postgresql':
+            # 'слово':* & 'другое':* — кавычки и обратные слэши экранируются
+            query = ' & '.join(
+                "'{}':*".format(term.replace('\\', '\\\\').replace("'", "''")) for term in terms
+            )
+            return await self.db.fetchall('''
+                WITH hits AS (
+                    SELECT id, ts_rank(content_tsv, query) AS rank
+                    FROM messages, to_tsquery('simple', ?) AS query
+                    WHERE content_tsv @@ query
+                    ORDER BY id DESC
+                    LIMIT ?
+                )
+                SELECT m.id, m.user_id, u.first_name, u.username, m.timestamp, m.content
+                FROM hits
+                JOIN messages AS m ON m.id = hits.id
+                LEFT JOIN users AS u ON u.user_id = m.user_id
+                ORDER BY hits.rank DESC, hits.id DESC
+                LIMIT ? OFFSET ?
+            ''', (query, candidates, limit, offset))
+
+        # FTS5: каждое слово — фраза в кавычках, так что операторы FTS5 из запроса не срабатывают
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        return await self.db.fetchall('''
+            WITH hits AS (
+                SELECT rowid AS id, rank FROM messages_fts
+                WHERE messages_fts MATCH ?
+                ORDER BY rowid DESC
+                LIMIT ?
+            )
+            SELECT m.id, m.user_id, u.first_name, u.username, m.timestamp, m.content
+            FROM hits
+            JOIN messages AS m ON m.id = hits.id
+            LEFT JOIN users AS u ON u.user_id = m.user_id
+            ORDER BY hits.rank, hits.id DESC
+            LIMIT ? OFFSET ?
+        ''', (match, candidates, limit, offset))
+
+    async def rebuild_search_index(self):
+        if self.db.dialect == 'postgresql':
+            # tsvector вычисляется сам, пересобираем только индекс
+            await self.db.execute('REINDEX INDEX idx_messages_fts')
+            return
+        async with self.db.transaction() as tx:
+            await tx.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            await tx.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+
+    # === Удаление небольшими порциями: каждая порция — своя короткая транзакция ===
+    async def delete_messages_before(self, cutoff: str, content_type: str = None, exclude_types=(),
+                                     limit: int = 500) -> int:
+        # exclude_types — типы со своим сроком хранения: общий срок их не трогает
+        if content_type is None:
+            exclude_types = list(exclude_types)
+            excluded = ''
+            if exclude_types:
+                placeholders = ', '.join('?' * len(exclude_types))
+                excluded = f'AND (content_type IS NULL OR content_type NOT IN ({placeholders}))'
+            return await self.db.execute(f'''
+                DELETE FROM messages WHERE id IN (
+                    SELECT id FROM messages WHERE timestamp < ? {excluded} LIMIT ?
+                )
+            ''', (cutoff, *exclude_types, limit))
+        return await self.db.execute('''
+            DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages WHERE timestamp < ? AND content_type = ? LIMIT ?
+            )
+        ''', (cutoff, content_type, limit))
+
+    async def delete_messages_of_inactive_users(self, cutoff: str, limit: int = 500) -> int:
+        return await self.db.execute('''
+            DELETE FROM messages WHERE id IN (
+                SELECT m.id FROM users AS u
+                JOIN messages AS m ON m.user_id = u.user_id
+                WHERE u.last_seen < ?
+                LIMIT ?
+            )
+        ''', (cutoff, limit))
+
+    async def delete_all_messages(self, limit: int = 500) -> int:
+        return await self.db.execute('''
+            DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages ORDER BY id LIMIT ?
+            )
+        ''', (limit,))
+
+    async def delete_orphan_users(self, after_user_id: int = None, limit: int = 500):
+        # Проходим users по ключу и удаляем тех, у кого не осталось сообщений.
+        # Возвращает (удалено, последний просмотренный user_id или None, если дошли до конца)
+        rows = await self.db.fetchall(
+            'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            (after_user_id if after_user_id is not None else -2 ** 63, limit)
+        )
+        if not rows:
+            return 0, None
+        first, last = rows[0][0], rows[-1][0]
+        deleted = await self.db.execute('''
+            DELETE FROM users
+            WHERE user_id BETWEEN ? AND ?
+              AND NOT EXISTS (SELECT 1 FROM messages AS m WHERE m.user_id = users.user_id)
+        ''', (first, last))
+        return deleted, last
+
+    async def delete_orphan_media(self, limit: int = 500) -> int:
+        return await self.db.execute('''
+            DELETE FROM media WHERE file_unique_id IN (
+                SELECT file_unique_id FROM media AS md
+                WHERE NOT EXISTS (SELECT 1 FROM messages AS m WHERE m.media_id = md.file_unique_id)
+                LIMIT ?
+            )
+        ''', (limit,))
+
+    async def reclaim_space(self, pages: int = 1000) -> int:
+        return await self.db.reclaim_space(pages)
+
+    async def vacuum(self) -> int:
+        return await self.db.vacuum()
+
+    # === Пользователи ===
+    async def user_exists(self, user_id: int) -> bool:
+        row = await self.db.fetchone('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+        return row is not None
+
+    async def search_users(self, query: str = None, before: tuple = None, limit: int = 10) -> list:
+        # Сначала недавно активные; before = (last_seen, user_id) последней строки прошлой страницы
+        conditions, params = [], []
+        key = search_key((query or '').strip().lstrip('@'))
+        if key:
+            key_end = key[:-1] + chr(ord(key[-1]) + 1)
+            condition = '(name_key >= ? AND name_key < ?) OR (username_key >= ? AND username_key < ?)'
+            params += [key, key_end, key, key_end]
+            if key.isdigit():
+                condition += ' OR user_id = ?'
+                params.append(int(key))
+            conditions.append(f'({condition})')
+        if before is not None:
+            conditions.append('(last_seen, user_id) < (?, ?)')
+            params += list(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return await self.db.fetchall(f'''
+            SELECT user_id, first_name, username, last_seen
+            FROM users
+            {where}
+            ORDER BY last_seen DESC, user_id DESC
+            LIMIT ?
+        ''', (*params, limit))
+
+    # === Состояние диалогов ===
+    async def get_session(self, user_id: int):
+        return await self.db.fetchone('SELECT mode, target_user_id FROM sessions WHERE user_id = ?', (user_id,))
+
+    async def save_session(self, user_id: int, mode: str, target_user_id=None):
+        await self.db.execute('''
+            INSERT INTO sessions (user_id, mode, target_user_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                mode = excluded.mode,
+                target_user_id = excluded.target_user_id,
+                updated_at = excluded.updated_at
+        ''', (user_id, mode, target_user_id))
+
+    # === Закрепление диалогов за админами ===
+    async def get_assignment(self, user_id: int):
+        # (admin_id, открыт ли диалог) или None
+        row = await self.db.fetchone('SELECT admin_id, closed_at IS NULL FROM assignments WHERE user_id = ?', (user_id,))
+        return (row[0], bool(row[1])) if row else None
+
+    async def assign_dialog(self, user_id: int, admin_id: int):
+        await self.db.execute('''
+            INSERT INTO assignments (user_id, admin_id, assigned_at, closed_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP, NULL)
+            ON CONFLICT (user_id) DO UPDATE SET
+                admin_id = excluded.admin_id,
+                assigned_at = excluded.assigned_at,
+                closed_at = NULL
+        ''', (user_id, admin_id))
+
+    async def close_dialog(self, user_id: int) -> bool:
+        closed = await self.db.execute(
+            'UPDATE assignments SET closed_at = CURRENT_TIMESTAMP WHERE user_id = ? AND closed_at IS NULL', (user_id,))
+        return closed > 0
+
+    async def count_open_dialogs(self) -> dict:
+        rows = await self.db.fetchall(
+            'SELECT admin_id, COUNT(*) FROM assignments WHERE closed_at IS NULL GROUP BY admin_id')
+        return dict(rows)
+
+    # === Очередь отправки (outbox) ===
+    async def enqueue_outbox(self, entries):
+        await self.db.execute_batch([(_INSERT_OUTBOX, list(entries))])
+
+    async def enqueue_reply(self, entry, user_id: int):
+        # Ответ админа: строка outbox и отметка "вопрос отвечен" с временем ожидания — одна транзакция
+        now = datetime.now(timezone.utc)
+        async with self.db.transaction() as tx:
+            await tx.execute(_INSERT_OUTBOX, entry)
+            row = await tx.fetchone('DELETE FROM open_questions WHERE user_id = ? RETURNING asked_at', (user_id,))
+            if row is not None:
+                await tx.executemany(_ADD_STATS, reply_counters(max(0, int(now.timestamp()) - row[0]), now))
+
+    async def outbox_cycle(self, delivered, failed, limit: int, now: int, lease_until: int) -> list:
+        # Одна транзакция: записать итоги прошлых доставок и взять до limit следующих.
+        # delivered — [id]; failed — [(status, next_attempt_at, step, last_error, id)]
+        # Тело доставленной строки больше не нужно: остаётся только ключ идемпотентности
+        lock = 'FOR UPDATE SKIP LOCKED' if self.db.dialect == 'postgresql' else ''
+        async with self.db.transaction() as tx:
+            if delivered:
+                await tx.executemany('''
+                    UPDATE outbox SET status = 'delivered', calls = '[]', delivered_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', [(outbox_id,) for outbox_id in delivered])
+            if failed:
+                await tx.executemany(
+                    'UPDATE outbox SET status = ?, next_attempt_at = ?, step = ?, last_error = ? WHERE id = ?', failed)
+            if limit <= 0:
+                return []
+            rows = await tx.fetchall(_CLAIM_OUTBOX.format(lock=lock), (lease_until, now, limit))
+        return sorted(rows)
+
+    async def outbox_stats(self) -> dict:
+        return dict(await self.db.fetchall('SELECT status, COUNT(*) FROM outbox GROUP BY status'))
+
+    async def dead_letters(self, limit: int = 10) -> list:
+        # (id, stream, attempts, last_error, created_at), новые сверху
+        return await self.db.fetchall('''
+            SELECT id, stream, attempts, last_error, created_at FROM outbox
+            WHERE status = 'dead' ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+
+    async def retry_dead_letters(self) -> int:
+        return await self.db.execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'dead'")
+
+    async def purge_delivered_outbox(self, cutoff: str, limit: int = 500) -> int:
+        return await self.db.execute('''
+            DELETE FROM outbox WHERE id IN (
+                SELECT id FROM outbox WHERE status = 'delivered' AND delivered_at < ? LIMIT ?
+            )
+        ''', (cutoff, limit))
+
+    # === Обработанные обновления ===
+    async def claim_updates(self, update_ids, now: int) -> set:
+        # Отмечает update_ids обработанными; возвращает те, что раньше не встречались
+        values = ', '.join('(?, ?)' for _ in update_ids)
+        params = [value for update_id in update_ids for value in (update_id, now)]
+        async with self.db.transaction() as tx:
+            rows = await tx.fetchall(f'''
+                INSERT INTO processed_updates (update_id, processed_at) VALUES {values}
+                ON CONFLICT (update_id) DO NOTHING
+                RETURNING update_id
+            ''', params)
+        return {row[0] for row in rows}
+
+    async def purge_processed_updates(self, cutoff: int, limit: int = 5000) -> int:
+        return await self.db.execute('''
+            DELETE FROM processed_updates WHERE update_id IN (
+                SELECT update_id FROM processed_updates WHERE processed_at < ? LIMIT ?
+            )
+        ''', (cutoff, limit))
+
+    # === Статистика (/stats) ===
+    async def get_stats(self, since: str) -> list:
+        # (period, metric, key, value): итоги за всё время и дни/часы начиная с since
+        return await self.db.fetchall(
+            "SELECT period, metric, key, value FROM stats WHERE period = '' OR period >= ?", (since,))
+
+    async def open_questions_summary(self):
+        # (сколько ждут ответа, время самого старого вопроса в секундах Unix)
+        return await self.db.fetchone('SELECT COUNT(*), MIN(asked_at) FROM open_questions')
+
+    async def rebuild_stats(self):
+        async with self.db.transaction() as tx:
+            await backfill_stats(tx)
@@ -0,0 +1,150 @@
+import importlib
+import itertools
+import sys
+import time
+from contextlib import asynccontextmanager
+
+from aiogram import Bot, types
+from aiogram.client.session.base import BaseSession
+
+
+# === Подмена Bot API: запросы не уходят в сеть, а складываются в calls ===
+class FakeSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self._message_ids = itertools.count(1000)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        name = type(method).__name__
+        if name in ("SendMessage", "ForwardMessage", "SendPhoto", "SendDocument"):
+            chat = types.Chat(id=getattr(method, "chat_id", 0), type="private")
+            return types.Message(message_id=next(self._message_ids), date=0, chat=chat, text=getattr(method, "text", None))
+        if name == "CopyMessage":
+            return types.MessageId(message_id=next(self._message_ids))
+        if name in ("SendMediaGroup", "ForwardMessages", "CopyMessages"):
+            return []
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+def fake_bot():
+    return Bot("123456:TEST", session=FakeSession())
+
+
+def message_update(update_id, user_id, text="привет"):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Ivan", "username": "ivan"},
+            "text": text,
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Ivan", "username": "ivan"},
+            "chat_instance": "test",
+            "data": data,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "x"},
+        },
+    }
+
+
+def import_main(monkeypatch, tmp_path, session=None, **env):
+    # main настраивается переменными окружения при импорте: каждый тест получает свежий модуль и свою базу
+    env = {"BOT_TOKEN": "123456:TEST", "ADMIN_USER_ID": "1", "DATABASE_URL": str(tmp_path / "bot.db"), **env}
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    sys.modules.pop("main", None)
+    main = importlib.import_module("main")
+    session = session or FakeSession()
+    session.middleware = main.bot.session.middleware
+    main.bot.session = session
+    return main
+
+
+# === Подмена Redis для RedisState: только нужные ему команды, время жизни — по time.monotonic ===
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def _alive(self, key):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return item
+
+    async def get(self, key):
+        item = self._alive(key)
+        return item[0] if item is not None else None
+
+    async def set(self, key, value, px=None):
+        self.data[key] = (str(value).encode(), time.monotonic() + px / 1000 if px else None)
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    def _incrby(self, key, amount):
+        item = self._alive(key)
+        value = int(item[0]) + amount if item is not None else amount
+        self.data[key] = (str(value).encode(), item[1] if item is not None else None)
+        return value
+
+    def _pexpire(self, key, ms):
+        item = self._alive(key)
+        if item is not None:
+            self.data[key] = (item[0], time.monotonic() + ms / 1000)
+        return item is not None
+
+    @asynccontextmanager
+    async def pipeline(self, transaction=True):
+        yield FakePipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def incrby(self, key, amount):
+        self.commands.append((self.redis._incrby, key, amount))
+
+    def pexpire(self, key, ms):
+        self.commands.append((self.redis._pexpire, key, ms))
+
+    async def execute(self):
+        # Команды MULTI/EXEC выполняются подряд, без переключения на другие задачи
+        return [command(*args) for command, *args in self.commands]
+
+
+# === Часы, которые двигает тест: подменяют модуль time там, где нужны time() и monotonic() ===
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from aiogram import Dispatcher, types
+
+import antiflood
+from antiflood import ALLOW, DROP, MUTE, AntiFloodMiddleware, FloodLimiter, parse_flood_limits
+from fakes import FakeClock, fake_bot, message_update
+
+
+def test_parse_flood_limits():
+    assert parse_flood_limits("default:20/60, sticker:5/30,callback:30/0.5") == {
+        "default": (20, 60.0), "sticker": (5, 30.0), "callback": (30, 0.5)}
+    assert parse_flood_limits("") == {}
+    assert parse_flood_limits(None) == {}
+
+
+@pytest.mark.parametrize("value", ["sticker:5", "sticker:пять/30", "sticker:5/", "sticker:0/30", "sticker:5/0"])
+def test_parse_flood_limits_rejects_malformed(value):
+    with pytest.raises(ValueError, match="FLOOD_LIMITS"):
+        parse_flood_limits(value)
+
+
+def test_sliding_window():
+    limiter = FloodLimiter({"default": (3, 10)}, mute_seconds=60)
+    assert [limiter.check(1, "text", now) for now in (0, 1, 2)] == [ALLOW] * 3
+    # Окно скользит: четвёртое через 10 с после первого уже в лимите
+    assert limiter.check(1, "text", 10) == ALLOW
+    assert limiter.check(1, "text", 11.5) == ALLOW
+    # А здесь в последних 10 с уже три: 2, 10 и 11.5
+    assert limiter.check(1, "text", 11.9) == MUTE
+    # Другой пользователь считается отдельно
+    assert limiter.check(2, "text", 11.9) == ALLOW
+
+
+def test_limits_per_kind():
+    limiter = FloodLimiter({"default": (100, 60), "sticker": (2, 30)})
+    assert [limiter.check(1, "sticker", 0) for _ in range(3)] == [ALLOW, ALLOW, MUTE]
+    # Тип без своего правила и без default не ограничен
+    unlimited = FloodLimiter({"sticker": (1, 30)})
+    assert [unlimited.check(1, "text", 0) for _ in range(50)] == [ALLOW] * 50
+
+
+def test_mute_expires():
+    limiter = FloodLimiter({"default": (1, 10)}, mute_seconds=60)
+    assert limiter.check(1, "text", 0) == ALLOW
+    assert limiter.check(1, "text", 1) == MUTE
+    # Пока заглушён — отбрасывается всё, и предупреждение уже не повторяется
+    assert limiter.check(1, "sticker", 30) == DROP
+    assert limiter.check(1, "text", 60.9) == DROP
+    assert limiter.muted_for(1, 31) == 30
+    assert limiter.check(1, "text", 61) == ALLOW
+    assert limiter.muted_for(1, 61) == 0
+    assert (limiter.mutes, limiter.dropped) == (1, 3)
+
+
+def test_max_keys_evicts_longest_silent():
+    limiter = FloodLimiter({"default": (1, 100)}, mute_seconds=60, max_keys=2)
+    limiter.check(1, "text", 0)
+    limiter.check(2, "text", 1)
+    limiter.check(1, "text", 2)
+    limiter.check(3, "text", 3)
+    assert len(limiter._windows) == 2
+    # Окно пользователя 2 вытеснено: его следующее сообщение снова первое в окне
+    assert limiter.check(2, "text", 4) == ALLOW
+    # Заглушения тоже ограничены max_keys
+    for user_id in (4, 5, 6):
+        limiter.check(user_id, "text", 5)
+        limiter.check(user_id, "text", 5)
+    assert list(limiter._muted) == [5, 6]
+
+
+def flood_dispatcher(limiter, handled, admin_id=1):
+    dp = Dispatcher()
+    dp.update.outer_middleware(AntiFloodMiddleware(limiter, exempt=lambda user_id: user_id == admin_id))
+
+    @dp.message()
+    async def handler(message: types.Message):
+        handled.append(message.message_id)
+
+    return dp
+
+
+def warnings(bot):
+    return [call for call in bot.session.calls if type(call).__name__ == "SendMessage"]
+
+
+def test_middleware_warns_once_per_mute(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(antiflood, "time", clock)
+
+    async def scenario():
+        handled = []
+        bot = fake_bot()
+        dp = flood_dispatcher(FloodLimiter({"default": (2, 10)}, mute_seconds=30), handled)
+        for update_id in range(1, 7):
+            await dp.feed_update(bot, types.Update.model_validate(message_update(update_id, 10)))
+        assert handled == [1, 2]
+        [warning] = warnings(bot)
+        assert warning.chat_id == 10
+
+        # Заглушение кончилось — сообщения снова доходят; новый флуд — новое предупреждение
+        clock.advance(31)
+        for update_id in range(7, 11):
+            await dp.feed_update(bot, types.Update.model_validate(message_update(update_id, 10)))
+        assert handled == [1, 2, 7, 8]
+        assert len(warnings(bot)) == 2
+
+    asyncio.run(scenario())
+
+
+def test_middleware_exempts_admins():
+    async def scenario():
+        handled = []
+        bot = fake_bot()
+        dp = flood_dispatcher(FloodLimiter({"default": (1, 60)}), handled, admin_id=1)
+        for update_id in range(1, 6):
+            await dp.feed_update(bot, types.Update.model_validate(message_update(update_id, 1)))
+        assert handled == [1, 2, 3, 4, 5]
+        assert warnings(bot) == []
+
+    asyncio.run(scenario())
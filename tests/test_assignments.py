@@ -0,0 +1,38 @@
+import asyncio
+
+import assignments
+import sessions
+from assignments import AdminPool
+from fakes import FakeClock
+from state import MemoryState
+from storage import Storage
+
+
+def test_idle_admin_stays_idle_beyond_cache_ttl(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(assignments, "time", clock)
+    monkeypatch.setattr(sessions, "time", clock)
+
+    async def scenario():
+        storage = Storage.from_path(str(tmp_path / "dialogs.db"))
+        await storage.open()
+        # Неактивным админ считается через 2 часа — дольше, чем живёт запись в кэше (1 час)
+        pool = AdminPool(storage, MemoryState(ttl=3600), [1, 2], idle_minutes=120)
+        await pool.load()
+        assert await pool.route(100) == 1
+
+        clock.advance(3 * 3600)
+        await pool.touch(2)
+        stats = {row['admin_id']: row for row in await pool.stats()}
+        assert stats[1]['idle_seconds'] == 3 * 3600
+        assert not stats[1]['available']
+        assert stats[2]['available']
+        # Диалог неактивного админа переходит к активному, новые — тоже к нему
+        assert await pool.route(100) == 2
+        assert await pool.route(101) == 2
+
+        await pool.touch(1)
+        assert await pool._available(1)
+        await storage.close()
+
+    asyncio.run(scenario())
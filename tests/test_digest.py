@@ -0,0 +1,160 @@
+import asyncio
+
+from aiogram import types
+
+from digest import DigestBuffer, combine_texts
+from fakes import callback_update, import_main, message_update
+from history import text_length
+
+
+# === Сводка собирает то, что отдано в deliver, и когда ===
+class Collector:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    async def deliver(self, user_id, items):
+        loop = asyncio.get_running_loop()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.batches.append((user_id, list(items), loop.time()))
+
+
+def test_quiet_window_flushes_batch():
+    async def scenario():
+        collector = Collector()
+        digest = DigestBuffer(collector.deliver, window_ms=100, max_wait_ms=5000)
+        for item in "abc":
+            digest.add(10, item)
+            await asyncio.sleep(0.03)
+        digest.add(11, "x")
+        assert collector.batches == []
+        await asyncio.sleep(0.2)
+        assert sorted((user_id, items) for user_id, items, _ in collector.batches) == [(10, ["a", "b", "c"]), (11, ["x"])]
+        assert digest.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_max_wait_flushes_busy_user():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        collector = Collector()
+        digest = DigestBuffer(collector.deliver, window_ms=100, max_wait_ms=250)
+        started = loop.time()
+        # Пишет чаще окна тишины: пачка всё равно уходит через max_wait после первого сообщения
+        for number in range(12):
+            digest.add(10, number)
+            await asyncio.sleep(0.04)
+        await digest.stop()
+        first = collector.batches[0]
+        assert 0.2 <= first[2] - started < 0.4
+        assert len(first[1]) < 12
+        assert [item for _, items, _ in collector.batches for item in items] == list(range(12))
+
+    asyncio.run(scenario())
+
+
+def test_max_items_and_urgent_flush_immediately():
+    async def scenario():
+        collector = Collector()
+        digest = DigestBuffer(collector.deliver, window_ms=10000, max_wait_ms=60000, max_items=3)
+        for item in "abc":
+            digest.add(10, item)
+        await asyncio.sleep(0)
+        assert [items for _, items, _ in collector.batches] == [["a", "b", "c"]]
+        # Срочное (вопрос) уходит сразу вместе с тем, что уже накопилось
+        digest.add(10, "d")
+        digest.add(10, "вопрос", urgent=True)
+        await asyncio.sleep(0.01)
+        assert [items for _, items, _ in collector.batches] == [["a", "b", "c"], ["d", "вопрос"]]
+
+    asyncio.run(scenario())
+
+
+def test_batches_of_one_user_are_delivered_in_order():
+    async def scenario():
+        collector = Collector(delay=0.05)
+        digest = DigestBuffer(collector.deliver, window_ms=10000, max_items=1)
+        for item in range(5):
+            digest.add(10, item)
+        await digest.stop()
+        assert [items for _, items, _ in collector.batches] == [[0], [1], [2], [3], [4]]
+
+    asyncio.run(scenario())
+
+
+def test_stop_flushes_pending():
+    async def scenario():
+        collector = Collector()
+        digest = DigestBuffer(collector.deliver, window_ms=10000)
+        digest.add(10, "a")
+        await digest.stop()
+        assert [items for _, items, _ in collector.batches] == [["a"]]
+
+    asyncio.run(scenario())
+
+
+def test_combine_texts_splits_by_utf16_length():
+    assert combine_texts("шапка", ["один", "два"]) == ["шапка\n\nодин\n\nдва"]
+    # Эмодзи — две единицы UTF-16: по символам влезло бы, по правилам Telegram — нет
+    texts = ["😀" * 30, "😀" * 30]
+    parts = combine_texts("h", texts, limit=64)
+    assert all(text_length(part) <= 64 for part in parts)
+    assert "".join(parts).replace("\n", "") == "h" + "😀" * 60
+    assert len(parts) == 2
+
+    long = combine_texts("шапка", ["я" * 5000])
+    assert [text_length(part) for part in long] == [4096, 5000 + 7 - 4096]
+    assert long[0].startswith("шапка\n\n")
+
+
+def test_deliver_digest_to_admin(tmp_path, monkeypatch):
+    main = import_main(monkeypatch, tmp_path, DIGEST_WINDOW_MS="500", DIGEST_MAX_WAIT_MS="5000",
+                       SEND_CHAT_RATE="1000", SEND_CHAT_BURST="1000")
+    calls = main.bot.session.calls
+
+    async def feed(update):
+        await main.dp.feed_update(main.bot, types.Update.model_validate(update))
+
+    async def delivered():
+        # Ждём, пока сводка соберётся и уйдёт через outbox
+        for _ in range(500):
+            stats = await main.storage.outbox_stats()
+            idle = not main.digest.pending and not main.digest._tasks
+            if idle and not stats.get('pending') and not stats.get('sending'):
+                return [call for call in calls if getattr(call, "chat_id", None) == 1]
+            await asyncio.sleep(0.01)
+        raise AssertionError("сводка не доставлена")
+
+    async def scenario():
+        await main.dp.emit_startup(bot=main.bot)
+        await feed(message_update(1, 10, "/start"))
+        await feed(message_update(2, 10, "📝 Оставить заявку на работу"))
+        await feed(callback_update(3, 10, "vacancy_translator"))
+        await delivered()
+        calls.clear()
+
+        # Строки анкеты без вопроса: одно сообщение, и на нём всё равно есть кнопка "Ответить"
+        for number in range(4, 7):
+            await feed(message_update(number, 10, f"строка {number}"))
+        [summary] = await delivered()
+        assert summary.text.endswith("строка 4\n\nстрока 5\n\nстрока 6")
+        assert "Вам задали вопрос" not in summary.text
+        assert summary.reply_markup.inline_keyboard[0][0].callback_data == "reply_10"
+
+        # Вопрос (DIGEST_BYPASS) уходит сразу, с заголовком вопроса
+        await feed(message_update(7, 11, "/start"))
+        await feed(message_update(8, 11, "❓ Задать вопрос"))
+        calls.clear()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await feed(message_update(9, 11, "когда собеседование?"))
+        [question] = await delivered()
+        assert loop.time() - started < 0.5
+        assert question.text.startswith("Вам задали вопрос")
+        assert question.reply_markup.inline_keyboard[0][0].callback_data == "reply_11"
+
+        await main.dp.emit_shutdown(bot=main.bot)
+
+    asyncio.run(scenario())
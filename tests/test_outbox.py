@@ -0,0 +1,113 @@
+import asyncio
+
+from outbox import OutboxWorkers, api_call, outbox_entry
+from storage import Storage
+
+
+# === Бот, у которого каждый вызов можно придержать ===
+class GatedBot:
+    def __init__(self):
+        self.sent = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.hold = set()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if text in self.hold:
+            self.started.set()
+            await self.release.wait()
+        self.sent.append(text)
+
+
+# === Хранилище, которое может задержать outbox_cycle посередине прохода воркера ===
+class PausingStorage:
+    def __init__(self, storage):
+        self.storage = storage
+        self.pause = False
+        self.entered = asyncio.Event()
+        self.proceed = asyncio.Event()
+
+    async def outbox_cycle(self, *args):
+        if self.pause:
+            self.pause = False
+            self.entered.set()
+            await self.proceed.wait()
+        return await self.storage.outbox_cycle(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+
+async def open_storage(tmp_path):
+    storage = Storage.from_path(str(tmp_path / "dialogs.db"))
+    await storage.open()
+    return storage
+
+
+def message_entry(key, *texts):
+    return outbox_entry(key, "1:10", [api_call('send_message', chat_id=10, text=text) for text in texts])
+
+
+async def outbox_row(storage, key):
+    return await storage.db.fetchone(
+        'SELECT status, step, last_error FROM outbox WHERE idempotency_key = ?', (key,))
+
+
+def test_stop_during_cycle_keeps_draining(tmp_path):
+    async def scenario():
+        storage = await open_storage(tmp_path)
+        bot = GatedBot()
+        bot.hold.add("медленно")
+        pausing = PausingStorage(storage)
+        workers = OutboxWorkers(pausing, bot, poll_interval=0.05)
+        await storage.enqueue_outbox([message_entry("k1", "медленно")])
+        workers.start()
+        await asyncio.wait_for(bot.started.wait(), 2)
+
+        # stop() приходит, пока воркер ждёт ответа базы: доставка не должна прерваться сразу
+        pausing.pause = True
+        workers.notify()
+        await asyncio.wait_for(pausing.entered.wait(), 2)
+        stopping = asyncio.create_task(workers.stop(drain_seconds=5))
+        await asyncio.sleep(0)
+        pausing.proceed.set()
+        await asyncio.sleep(0.1)
+        bot.release.set()
+        await asyncio.wait_for(stopping, 2)
+
+        assert bot.sent == ["медленно"]
+        assert (await outbox_row(storage, "k1"))[0] == 'delivered'
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_drain_deadline_cancels_and_keeps_step(tmp_path):
+    async def scenario():
+        storage = await open_storage(tmp_path)
+        bot = GatedBot()
+        bot.hold.add("второй")
+        workers = OutboxWorkers(storage, bot, poll_interval=0.05)
+        await storage.enqueue_outbox([message_entry("k1", "первый", "второй", "третий")])
+        workers.start()
+        await asyncio.wait_for(bot.started.wait(), 2)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await workers.stop(drain_seconds=0.2)
+        assert loop.time() - started < 1
+        # Первый вызов уже ушёл: строка сразу готова к повтору, но начнётся со второго
+        assert await outbox_row(storage, "k1") == ('pending', 1, 'cancelled')
+
+        bot.hold.clear()
+        workers = OutboxWorkers(storage, bot, poll_interval=0.05)
+        workers.start()
+        for _ in range(200):
+            if (await outbox_row(storage, "k1"))[0] == 'delivered':
+                break
+            await asyncio.sleep(0.01)
+        await workers.stop()
+        assert bot.sent == ["первый", "второй", "третий"]
+        await storage.close()
+
+    asyncio.run(scenario())
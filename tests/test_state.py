@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from fakes import FakeRedis
+from state import DatabaseState, MemoryState, RedisState
+from storage import Storage
+
+BACKENDS = ["memory", "database", "redis"]
+
+
+def run(backend, tmp_path, scenario, **kwargs):
+    # Состояние создаётся внутри цикла событий теста: базе нужны её потоки и соединения
+    async def main():
+        storage = None
+        if backend == "memory":
+            state = MemoryState(**kwargs)
+        elif backend == "database":
+            storage = Storage.from_path(str(tmp_path / "state.db"))
+            await storage.open()
+            state = DatabaseState(storage.db, **kwargs)
+        else:
+            state = RedisState(client=FakeRedis(), **kwargs)
+        try:
+            await scenario(state)
+        finally:
+            await state.close()
+            if storage is not None:
+                await storage.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_get_set_delete(backend, tmp_path):
+    async def scenario(state):
+        assert await state.get("missing") is None
+        await state.set("session:1", ["question", None])
+        await state.set("admin:1", {"open": 2})
+        assert await state.get("session:1") == ["question", None]
+        assert await state.get("admin:1") == {"open": 2}
+        await state.set("session:1", ["idle", 5])
+        assert await state.get("session:1") == ["idle", 5]
+        await state.delete("session:1")
+        assert await state.get("session:1") is None
+
+    run(backend, tmp_path, scenario)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_ttl(backend, tmp_path):
+    async def scenario(state):
+        await state.set("short", 1, ttl=0.05)
+        await state.set("forever", 2)
+        assert await state.get("short") == 1
+        await asyncio.sleep(0.1)
+        assert await state.get("short") is None
+        # Без ttl значение бессрочное — и в памяти тоже, хотя у кэша свой срок жизни
+        assert await state.get("forever") == 2
+
+    # Срок жизни кэша в памяти короче паузы в тесте
+    run(backend, tmp_path, scenario, **({"ttl": 0.05} if backend == "memory" else {}))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_incr(backend, tmp_path):
+    async def scenario(state):
+        assert await state.incr("replies") == 1
+        assert await state.incr("replies") == 2
+        assert await state.incr("replies", 5) == 7
+        assert await state.get("replies") == 7
+        results = await asyncio.gather(*(state.incr("parallel") for _ in range(20)))
+        assert sorted(results) == list(range(1, 21))
+        # Истёкший счётчик начинается заново
+        assert await state.incr("ticket", ttl=0.05) == 1
+        await asyncio.sleep(0.1)
+        assert await state.incr("ticket", ttl=0.05) == 1
+
+    run(backend, tmp_path, scenario)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_lock_is_exclusive_and_fifo(backend, tmp_path):
+    async def scenario(state):
+        inside, entered = [], []
+
+        async def worker(number):
+            async with state.lock("chat:1"):
+                inside.append(number)
+                assert len(inside) == 1
+                entered.append(number)
+                await asyncio.sleep(0.02)
+                inside.remove(number)
+
+        tasks = []
+        for number in range(5):
+            tasks.append(asyncio.create_task(worker(number)))
+            # Следующий встаёт в очередь, когда предыдущий уже взял билет
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        assert entered == [0, 1, 2, 3, 4]
+
+        # Другой ключ не ждёт
+        async with state.lock("chat:2", timeout=1):
+            pass
+
+    run(backend, tmp_path, scenario, poll_max=0.01)
+
+
+@pytest.mark.parametrize("backend", ["database", "redis"])
+def test_lock_holder_timeout(backend, tmp_path):
+    async def scenario(state):
+        entered = asyncio.Event()
+
+        async def slow():
+            async with state.lock("chat:1", timeout=0.2):
+                entered.set()
+                await asyncio.sleep(10)
+
+        holder = asyncio.create_task(slow())
+        await asyncio.wait_for(entered.wait(), 1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with state.lock("chat:1", timeout=0.2):
+            waited = loop.time() - started
+            # Владелец, не уложившийся в timeout, отменён и уже вышел: внутри только мы
+            assert holder.done()
+        with pytest.raises(TimeoutError):
+            await holder
+        assert waited < 0.5
+
+    run(backend, tmp_path, scenario, poll_max=0.01)
+
+
+@pytest.mark.parametrize("backend", ["database", "redis"])
+def test_lock_cancelled_waiter_does_not_stall_queue(backend, tmp_path):
+    async def scenario(state):
+        release = asyncio.Event()
+        entered = asyncio.Event()
+
+        async def holder():
+            async with state.lock("chat:1", timeout=5):
+                entered.set()
+                await release.wait()
+
+        first = asyncio.create_task(holder())
+        await asyncio.wait_for(entered.wait(), 1)
+        waiter = asyncio.create_task(state.lock("chat:1", timeout=5).__aenter__())
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        release.set()
+        await first
+
+        # Отменённый билет помечен skipped: следующий входит сразу, а не через timeout
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with state.lock("chat:1", timeout=5):
+            assert loop.time() - started < 0.5
+
+    run(backend, tmp_path, scenario, poll_max=0.01)
+
+
+@pytest.mark.parametrize("backend", ["database", "redis"])
+def test_lock_takes_over_after_crashed_holder(backend, tmp_path):
+    async def scenario(state):
+        # Процесс взял билет и упал, так и не пометив его
+        await state.incr("chat:1:ticket", ttl=3600)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with state.lock("chat:1", timeout=0.2):
+            waited = loop.time() - started
+        assert 0.3 <= waited < 1.5
+        assert await state.get("chat:1:done:2") == 'done'
+
+    run(backend, tmp_path, scenario, poll_max=0.01, lock_grace=0.1)
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import pytest
+
+from migrations import MIGRATIONS
+from outbox import api_call, outbox_entry
+from retention import RetentionEngine, RetentionPolicy
+from search import search_terms
+from storage import Storage
+
+# Postgres проверяется, только если задан TEST_DATABASE_URL. База должна быть отдельной:
+# перед каждым тестом схема public пересоздаётся с нуля
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+OLD = '2000-01-01 00:00:00'
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def database_url(request, tmp_path):
+    if request.param == "sqlite":
+        return str(tmp_path / "dialogs.db")
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    asyncio.run(_reset_postgres(TEST_DATABASE_URL))
+    return TEST_DATABASE_URL
+
+
+async def _reset_postgres(url):
+    import asyncpg
+
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+    finally:
+        await conn.close()
+
+
+def run(url, scenario):
+    # Каждый тест — в своём цикле событий: хранилище открывается и закрывается внутри него
+    async def main():
+        storage = Storage.from_url(url)
+        await storage.open()
+        try:
+            await scenario(storage)
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
+
+
+def user_row(user_id, content, content_type='text', first_name="Ivan", username="ivan", media=None):
+    return (user_id, 'user', content_type, content, first_name, username, media)
+
+
+def test_migrations(database_url):
+    async def scenario(storage):
+        latest = max(version for version, _, _ in MIGRATIONS)
+        assert storage.schema_version == latest
+        # Повторный запуск ничего не применяет и не дублирует версии
+        await storage.open()
+        assert storage.schema_version == latest
+        versions = await storage.db.fetchall('SELECT version FROM schema_version ORDER BY version')
+        assert [row[0] for row in versions] == list(range(1, latest + 1))
+
+    run(database_url, scenario)
+
+
+def test_save_messages(database_url):
+    async def scenario(storage):
+        photo = ('u1', 'file1', 'photo', 1000, None)
+        entry = outbox_entry("fwd:10:1", "1:10", [api_call('send_message', chat_id=1, text="x")])
+        await storage.save_messages([
+            user_row(10, "анкета", 'application'),
+            user_row(10, None, 'photo', media=photo),
+            user_row(10, "когда собеседование?", 'question'),
+            (10, 'admin', 'text', "ответ", None, None),
+        ], outbox=[entry])
+        # Повтор с тем же ключом идемпотентности не добавляет вторую строку outbox
+        await storage.save_messages([user_row(10, "ещё")], outbox=[entry])
+
+        page = await storage.get_history_page(10)
+        assert [(row[1], row[2], row[3], row[5]) for row in page] == [
+            ('user', 'application', "анкета", None),
+            ('user', 'photo', None, 'u1'),
+            ('user', 'question', "когда собеседование?", None),
+            ('admin', 'text', "ответ", None),
+            ('user', 'text', "ещё", None),
+        ]
+        assert await storage.get_message_media(page[1][0]) == (10, 'photo', 'file1', None)
+        assert await storage.user_exists(10)
+        assert await storage.outbox_stats() == {'pending': 1}
+
+        waiting, _ = await storage.open_questions_summary()
+        assert waiting == 1
+        totals = {(metric, key): value for period, metric, key, value in await storage.get_stats('9999') if period == ''}
+        assert totals[('messages', '')] == 5
+        assert totals[('content_type', 'question')] == 1
+        assert totals[('vacancy', "анкета")] == 1
+
+        # Счётчики, пересчитанные по истории, совпадают с накопленными
+        await storage.rebuild_stats()
+        rebuilt = {(metric, key): value for period, metric, key, value in await storage.get_stats('9999') if period == ''}
+        assert rebuilt == totals
+
+    run(database_url, scenario)
+
+
+def test_history_keyset(database_url):
+    async def scenario(storage):
+        await storage.save_messages([user_row(10, f"сообщение {i}") for i in range(5)] + [user_row(11, "чужое")])
+        first = await storage.get_history_page(10, limit=2)
+        assert [row[3] for row in first] == ["сообщение 0", "сообщение 1"]
+        second = await storage.get_history_page(10, after_id=first[-1][0], limit=2)
+        assert [row[3] for row in second] == ["сообщение 2", "сообщение 3"]
+        last = await storage.get_history_page(10, after_id=second[-1][0], limit=2)
+        assert [row[3] for row in last] == ["сообщение 4"]
+        # Назад от последней: строки всё равно по возрастанию id
+        back = await storage.get_history_page(10, before_id=last[0][0], limit=2)
+        assert back == second
+        assert await storage.has_history_before(10, first[0][0]) is False
+        assert await storage.has_history_after(10, last[0][0]) is False
+        assert await storage.has_history_after(10, first[0][0]) is True
+
+    run(database_url, scenario)
+
+
+def test_users_keyset(database_url):
+    async def scenario(storage):
+        names = [(21, "Ivan", "ivan"), (22, "Irina", "irina_k"), (23, "Oleg", None), (24, "Иван", "vanya"), (25, "Anna", "anna")]
+        await storage.save_messages([user_row(user_id, "привет", first_name=name, username=username)
+                                     for user_id, name, username in names])
+        # Постранично по (last_seen, user_id): без повторов и пропусков
+        seen, before = [], None
+        while True:
+            page = await storage.search_users(before=before, limit=2)
+            if not page:
+                break
+            seen += [row[0] for row in page]
+            before = (page[-1][3], page[-1][0])
+        assert seen == [25, 24, 23, 22, 21]
+
+        assert [row[0] for row in await storage.search_users("i")] == [22, 21]
+        assert [row[0] for row in await storage.search_users("@VAN")] == [24]
+        assert [row[0] for row in await storage.search_users("иВ")] == [24]
+        assert [row[0] for row in await storage.search_users("23")] == [23]
+
+    run(database_url, scenario)
+
+
+def test_search(database_url):
+    async def scenario(storage):
+        await storage.save_messages([
+            user_row(10, "Хочу работать переводчиком"),
+            user_row(11, "Работа на выходных?", 'question'),
+            user_row(12, "Спасибо за ответ"),
+        ])
+        found = await storage.search_messages(search_terms("работ"))
+        assert sorted(row[1] for row in found) == [10, 11]
+        assert [row[1] for row in await storage.search_messages(search_terms("работ переводчик"))] == [10]
+        assert await storage.search_messages(search_terms("собеседование")) == []
+        # Кавычки и операторы полнотекстового индекса в запросе — просто текст
+        assert await storage.search_messages(search_terms('"спасибо" OR*')) == []
+        # Удалённое сообщение пропадает из индекса
+        await storage.delete_messages_before('9999-01-01 00:00:00', content_type='question')
+        assert [row[1] for row in await storage.search_messages(search_terms("работ"))] == [10]
+
+    run(database_url, scenario)
+
+
+def test_retention(database_url):
+    async def scenario(storage):
+        await storage.save_messages([
+            user_row(10, "старый текст"),
+            user_row(11, None, 'voice', media=('v1', 'voice1', 'voice', 10, 'audio/ogg')),
+            user_row(11, "старый стикер", 'sticker'),
+            user_row(12, "свежий текст"),
+        ])
+        await storage.db.execute('UPDATE messages SET timestamp = ? WHERE user_id IN (10, 11)', (OLD,))
+
+        # Свой срок для voice длиннее общего: общий срок голосовые не трогает
+        policy = RetentionPolicy(max_age_days=30, content_type_days={'voice': 36500})
+        report = await RetentionEngine(storage, policy, chunk_size=1, pause=0).run()
+        assert report['messages'] == 2
+        rows = await storage.db.fetchall('SELECT user_id, content_type FROM messages ORDER BY id')
+        assert rows == [(11, 'voice'), (12, 'text')]
+        # Пользователь без сообщений удалён, файл голосового остался
+        assert report['users'] == 1
+        assert not await storage.user_exists(10)
+        assert report['media'] == 0
+
+        report = await RetentionEngine(storage, RetentionPolicy(content_type_days={'voice': 1}), pause=0).run()
+        assert report['messages'] == 1
+        assert report['media'] == 1
+        assert report['pages_freed'] >= 0
+
+    run(database_url, scenario)
+
+
+def test_outbox_claim(database_url):
+    async def scenario(storage):
+        call = [api_call('send_message', chat_id=1, text="x")]
+        await storage.enqueue_outbox([
+            outbox_entry("a1", "1:10", call),
+            outbox_entry("b1", "1:11", call),
+            outbox_entry("a2", "1:10", call),
+        ])
+        ids = dict(await storage.db.fetchall('SELECT idempotency_key, id FROM outbox'))
+
+        # Берутся только головы потоков: a2 ждёт, пока не доставлено a1
+        rows = await storage.outbox_cycle([], [], limit=10, now=1000, lease_until=2000)
+        assert [row[0] for row in rows] == [ids['a1'], ids['b1']]
+        assert json.loads(rows[0][1]) == call
+        assert [row[3] for row in rows] == [1, 1]
+
+        # a1 доставлено — следующим берётся a2; b1 всё ещё под арендой
+        rows = await storage.outbox_cycle([ids['a1']], [], limit=10, now=1500, lease_until=2500)
+        assert [row[0] for row in rows] == [ids['a2']]
+
+        # Аренда b1 и a2 истекла (процесс упал) — строки берутся снова со следующей попыткой
+        rows = await storage.outbox_cycle([], [], limit=10, now=3000, lease_until=4000)
+        assert [(row[0], row[3]) for row in rows] == [(ids['b1'], 2), (ids['a2'], 2)]
+
+        # Ошибка уводит строку в dead, и она больше не берётся
+        failed = [('dead', 0, 0, "Bad Request", ids['b1'])]
+        rows = await storage.outbox_cycle([ids['a2']], failed, limit=10, now=5000, lease_until=6000)
+        assert rows == []
+        assert await storage.outbox_stats() == {'delivered': 2, 'dead': 1}
+        assert [row[0] for row in await storage.dead_letters()] == [ids['b1']]
+        assert await storage.retry_dead_letters() == 1
+        rows = await storage.outbox_cycle([], [], limit=10, now=5000, lease_until=6000)
+        assert [(row[0], row[3]) for row in rows] == [(ids['b1'], 1)]
+
+    run(database_url, scenario)
+
+
+def test_claim_updates(database_url):
+    async def scenario(storage):
+        assert await storage.claim_updates([1, 2, 3], now=100) == {1, 2, 3}
+        assert await storage.claim_updates([3, 4], now=200) == {4}
+        assert await storage.purge_processed_updates(cutoff=150) == 3
+        assert await storage.claim_updates([1], now=300) == {1}
+
+    run(database_url, scenario)
@@ -0,0 +1,178 @@
+import asyncio
+
+from aiogram import Dispatcher, types
+
+from fakes import FakeSession, fake_bot, import_main, message_update
+from storage import Storage
+from updates import ProcessedUpdates, UpdateGuardMiddleware
+
+
+async def open_storage(tmp_path):
+    storage = Storage.from_path(str(tmp_path / "dialogs.db"))
+    await storage.open()
+    return storage
+
+
+# === Хранилище, которое считает пачки отметок и может отказать ===
+class RecordingStorage:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+        self.seen = set()
+
+    async def claim_updates(self, update_ids, now):
+        self.batches.append(list(update_ids))
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("база недоступна")
+        claimed = set(update_ids) - self.seen
+        self.seen.update(update_ids)
+        return claimed
+
+    async def purge_processed_updates(self, cutoff, limit=5000):
+        return 0
+
+
+def test_duplicate_is_claimed_once(tmp_path):
+    async def scenario():
+        storage = await open_storage(tmp_path)
+        processed = ProcessedUpdates(storage)
+        assert await processed.claim(1) is True
+        assert await processed.claim(1) is False
+        # После перезапуска кэш пуст, но повтор узнаётся по таблице
+        restarted = ProcessedUpdates(storage)
+        assert await restarted.claim(1) is False
+        assert await restarted.claim(2) is True
+        assert (processed.duplicates, restarted.duplicates) == (1, 1)
+        await processed.stop()
+        await restarted.stop()
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_claims_are_grouped():
+    async def scenario():
+        storage = RecordingStorage()
+        processed = ProcessedUpdates(storage, batch_size=4)
+        results = await asyncio.gather(*(processed.claim(update_id) for update_id in range(10)))
+        assert results == [True] * 10
+        # Одновременные отметки уходят в базу пачками не больше batch_size, а не по одной
+        assert storage.batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+        # Повтор, пока первая отметка ещё пишется, тоже отсеивается
+        first, second = await asyncio.gather(processed.claim(20), processed.claim(20))
+        assert (first, second) == (True, False)
+        await processed.stop()
+
+    asyncio.run(scenario())
+
+
+def test_database_failure_lets_updates_through():
+    async def scenario():
+        processed = ProcessedUpdates(RecordingStorage(fail=True))
+        assert await processed.claim(1) is True
+        # Память о недавних id работает и без базы
+        assert await processed.claim(1) is False
+        await processed.stop()
+
+    asyncio.run(scenario())
+
+
+def guarded_dispatcher(guard, handled, gate=None):
+    dp = Dispatcher()
+    dp.update.outer_middleware(guard)
+
+    @dp.message()
+    async def handler(message: types.Message):
+        if gate is not None:
+            await gate.wait()
+        handled.append(message.message_id)
+
+    return dp
+
+
+def test_guard_skips_redelivered_update(tmp_path):
+    async def scenario():
+        storage = await open_storage(tmp_path)
+        handled = []
+        guard = UpdateGuardMiddleware(ProcessedUpdates(storage))
+        dp = guarded_dispatcher(guard, handled)
+        bot = fake_bot()
+        update = types.Update.model_validate(message_update(7, 10))
+        await dp.feed_update(bot, update)
+        await dp.feed_update(bot, update)
+        await dp.feed_update(bot, types.Update.model_validate(message_update(8, 10)))
+        assert handled == [7, 8]
+        assert guard.active == 0
+        await guard.processed.stop()
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_drain_waits_for_handlers_until_deadline():
+    async def scenario():
+        gate = asyncio.Event()
+        handled = []
+        guard = UpdateGuardMiddleware()
+        dp = guarded_dispatcher(guard, handled, gate)
+        bot = fake_bot()
+        feeding = asyncio.create_task(dp.feed_update(bot, types.Update.model_validate(message_update(1, 10))))
+        await asyncio.sleep(0.01)
+        assert guard.active == 1
+
+        # Обработчик не успел — drain возвращается по сроку и сообщает, сколько осталось
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await guard.drain(0.1) == 1
+        assert 0.1 <= loop.time() - started < 0.5
+
+        # Успел — drain возвращается сразу после него
+        loop.call_later(0.05, gate.set)
+        assert await guard.drain(5) == 0
+        assert loop.time() - started < 1
+        await feeding
+        assert handled == [1]
+
+    asyncio.run(scenario())
+
+
+# === Остановка бота целиком: база закрывается только после начатых обработчиков ===
+class GatedSession(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.gate = asyncio.Event()
+        self.waiting = asyncio.Event()
+
+    async def make_request(self, bot, method, timeout=None):
+        if type(method).__name__ == "SendMessage" and getattr(method, "chat_id", None) == 10:
+            self.waiting.set()
+            await self.gate.wait()
+        return await super().make_request(bot, method, timeout)
+
+
+def test_shutdown_drains_handlers_before_closing(tmp_path, monkeypatch):
+    session = GatedSession()
+    main = import_main(monkeypatch, tmp_path, session, SHUTDOWN_DRAIN_SECONDS="5")
+
+    async def scenario():
+        await main.dp.emit_startup(bot=main.bot)
+
+        feeding = asyncio.create_task(
+            main.dp.feed_update(main.bot, types.Update.model_validate(message_update(1, 10, "/start"))))
+        await asyncio.wait_for(session.waiting.wait(), 5)
+        order = []
+        feeding.add_done_callback(lambda _: order.append("handler"))
+        stopping = asyncio.create_task(main.dp.emit_shutdown(bot=main.bot))
+        stopping.add_done_callback(lambda _: order.append("shutdown"))
+
+        await asyncio.sleep(0.2)
+        assert not stopping.done()
+        # База ещё открыта: обработчик в работе
+        assert await main.storage.get_session(10) == ('idle', None)
+        session.gate.set()
+        await asyncio.wait_for(stopping, 5)
+        await feeding
+        assert order == ["handler", "shutdown"]
+
+    asyncio.run(scenario())
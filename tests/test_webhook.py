@@ -0,0 +1,123 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+from aiogram import Dispatcher, types
+
+from fakes import fake_bot, message_update
+from webhook import SECRET_HEADER, create_app
+
+SECRET = "s3cret"
+
+
+@asynccontextmanager
+async def serve(app):
+    # ASGITransport не запускает lifespan сам: поднимаем его вручную, как это делает uvicorn
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+
+
+def echo_dispatcher(received):
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: types.Message):
+        received.append(message.text)
+        await message.answer(f"эхо: {message.text}")
+
+    return dp
+
+
+async def wait_for(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+def test_bad_secret_is_rejected():
+    async def scenario():
+        received = []
+        bot = fake_bot()
+        app = create_app(echo_dispatcher(received), bot, secret_token=SECRET)
+        async with serve(app) as client:
+            wrong = await client.post("/webhook", json=message_update(1, 10), headers={SECRET_HEADER: "wrong"})
+            missing = await client.post("/webhook", json=message_update(2, 10))
+            await asyncio.sleep(0.05)
+        assert wrong.status_code == 403
+        assert missing.status_code == 403
+        assert received == []
+        assert bot.session.calls == []
+
+    asyncio.run(scenario())
+
+
+def test_valid_update_is_dispatched():
+    async def scenario():
+        received = []
+        bot = fake_bot()
+        app = create_app(echo_dispatcher(received), bot, secret_token=SECRET)
+        async with serve(app) as client:
+            response = await client.post(
+                "/webhook", json=message_update(1, 10, "привет"), headers={SECRET_HEADER: SECRET})
+            assert response.status_code == 200
+            await wait_for(lambda: bot.session.calls)
+        assert received == ["привет"]
+        [call] = bot.session.calls
+        assert type(call).__name__ == "SendMessage"
+        assert call.chat_id == 10
+        assert call.text == "эхо: привет"
+
+    asyncio.run(scenario())
+
+
+def test_invalid_update_is_bad_request():
+    async def scenario():
+        app = create_app(echo_dispatcher([]), fake_bot())
+        async with serve(app) as client:
+            response = await client.post("/webhook", json={"update_id": "не число"})
+        assert response.status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_returns_503():
+    async def scenario():
+        started = asyncio.Event()
+        release = asyncio.Event()
+        handled = []
+        dp = Dispatcher()
+
+        @dp.message()
+        async def slow(message: types.Message):
+            started.set()
+            await release.wait()
+            handled.append(message.message_id)
+
+        app = create_app(dp, fake_bot(), workers=1, queue_size=1)
+        async with serve(app) as client:
+            # Первое обновление занимает обработчик, второе ждёт в очереди, третьему места нет
+            first = await client.post("/webhook", json=message_update(1, 10))
+            await asyncio.wait_for(started.wait(), 2)
+            second = await client.post("/webhook", json=message_update(2, 10))
+            third = await client.post("/webhook", json=message_update(3, 10))
+            assert [first.status_code, second.status_code, third.status_code] == [200, 200, 503]
+            release.set()
+        # При остановке принятые обновления дорабатываются
+        assert handled == [1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_health():
+    async def scenario():
+        app = create_app(echo_dispatcher([]), fake_bot(), workers=3, stats=lambda: {"pending": 0})
+        async with serve(app) as client:
+            response = await client.get("/health")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok", "queue_depth": 0, "workers": 3, "pending": 0}
+
+    asyncio.run(scenario())
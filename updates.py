@@ -0,0 +1,125 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600
+
+
+# === Обработанные update_id: повторная доставка от Telegram не обрабатывается второй раз ===
+# Свежие id — в памяти (не больше cache_size), все — в таблице processed_updates (keep_hours часов).
+# Обновление помечается до обработки: упавший посреди обработчика процесс его уже не повторит,
+# зато повтор не создаст второй строки в базе и второго уведомления админу.
+class ProcessedUpdates:
+    def __init__(self, storage, cache_size=10000, keep_hours=24, batch_size=500):
+        self.storage = storage
+        self.cache_size = max(1, cache_size)
+        self.keep_seconds = keep_hours * 3600
+        self.batch_size = max(1, batch_size)
+        self._recent = OrderedDict()
+        self._pending = {}
+        self._flushing = None
+        self._purging = None
+        self._purged_at = 0.0
+        self.duplicates = 0
+
+    async def claim(self, update_id: int) -> bool:
+        # True — обновление новое, обрабатываем; False — уже обработано (или обрабатывается)
+        if update_id in self._recent:
+            self._recent.move_to_end(update_id)
+            self.duplicates += 1
+            return False
+        self._recent[update_id] = None
+        if len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+
+        # Отметки, пришедшие пока пишется предыдущая пачка, уходят в базу следующей одной транзакцией
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update_id] = future
+        if self._flushing is None:
+            self._flushing = asyncio.create_task(self._flush(), name="processed-updates")
+        if not await future:
+            self.duplicates += 1
+            return False
+        return True
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                batch = dict(itertools.islice(self._pending.items(), self.batch_size))
+                for update_id in batch:
+                    del self._pending[update_id]
+                try:
+                    claimed = await self.storage.claim_updates(list(batch), int(time.time()))
+                except Exception:
+                    # База недоступна — лучше обработать возможный повтор, чем потерять обновление
+                    logger.exception("Не удалось отметить %d обновлений", len(batch))
+                    claimed = set(batch)
+                for update_id, future in batch.items():
+                    if not future.done():
+                        future.set_result(update_id in claimed)
+            self._maybe_purge()
+        finally:
+            self._flushing = None
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if self._purging is not None or now - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        self._purging = asyncio.create_task(self._purge())
+
+    async def _purge(self):
+        cutoff = int(time.time() - self.keep_seconds)
+        try:
+            while await self.storage.purge_processed_updates(cutoff) > 0:
+                await asyncio.sleep(0.05)
+        except Exception:
+            logger.exception("Не удалось очистить старые update_id")
+        finally:
+            self._purging = None
+
+    async def stop(self):
+        for task in (self._flushing, self._purging):
+            if task is not None:
+                await asyncio.gather(task, return_exceptions=True)
+
+
+# === Самый внешний middleware: отсев повторов и учёт обновлений в работе ===
+# drain() ждёт, пока начатые обработчики закончат: при остановке приём уже прекращён,
+# а база и очереди записи закрываются только после них.
+class UpdateGuardMiddleware(BaseMiddleware):
+    def __init__(self, processed=None, metrics=None):
+        self.processed = processed
+        self.metrics = metrics
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.active += 1
+        self._idle.clear()
+        try:
+            if self.processed is not None and not await self.processed.claim(event.update_id):
+                logger.info("Повторная доставка обновления %s пропущена", event.update_id)
+                if self.metrics is not None:
+                    self.metrics.duplicate_updates.inc()
+                return None
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            if not self.active:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> int:
+        # Сколько обработчиков так и не закончились за timeout секунд
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.active
@@ -0,0 +1,124 @@
+import asyncio
+import hmac
+import logging
+from contextlib import asynccontextmanager
+
+from aiogram import types
+from fastapi import FastAPI, Request, Response
+
+from metrics import add_metrics_route
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_key(update: types.Update) -> int:
+    # Обновления одного пользователя всегда попадают к одному обработчику — порядок сохраняется
+    event = update.event
+    from_user = getattr(event, "from_user", None)
+    if from_user is not None:
+        return from_user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+# === Очередь входящих обновлений с несколькими обработчиками ===
+class UpdateQueue:
+    def __init__(self, dp, bot, workers=4, maxsize=1000):
+        self.dp = dp
+        self.bot = bot
+        self.workers = max(1, workers)
+        per_worker = max(1, maxsize // self.workers)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks = []
+
+    @property
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._consume(queue), name=f"update-worker-{i}")
+            for i, queue in enumerate(self._queues)
+        ]
+
+    async def stop(self, timeout=None):
+        # Дорабатываем уже принятые обновления, но не дольше timeout секунд
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Остановка: %d принятых обновлений не обработаны", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def put_nowait(self, update: types.Update):
+        queue = self._queues[update_key(update) % self.workers]
+        queue.put_nowait(update)
+
+    async def _consume(self, queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("Ошибка при обработке обновления %s", update.update_id)
+            finally:
+                queue.task_done()
+
+
+# === FastAPI-приложение для приёма вебхуков ===
+def create_app(dp, bot, secret_token=None, path="/webhook", webhook_url=None, workers=4, queue_size=1000,
+               stats=None, metrics=None, drain_seconds=None):
+    updates = UpdateQueue(dp, bot, workers=workers, maxsize=queue_size)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await dp.emit_startup(bot=bot)
+        updates.start()
+        if webhook_url:
+            await bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=dp.resolve_used_update_types())
+        try:
+            yield
+        finally:
+            await updates.stop(drain_seconds)
+            await dp.emit_shutdown(bot=bot)
+            await bot.session.close()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.updates = updates
+    if metrics is not None:
+        metrics.queue_depth.set_function("updates", fn=lambda: updates.depth)
+        add_metrics_route(app, metrics)
+
+    @app.post(path)
+    async def receive_update(request: Request):
+        if secret_token:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received, secret_token):
+                return Response(status_code=403)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": bot})
+        except ValueError:
+            return Response(status_code=400)
+        try:
+            updates.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            logger.warning("Очередь обновлений переполнена, update_id=%s отклонён", update.update_id)
+            return Response(status_code=503)
+        return Response(status_code=200)
+
+    @app.get("/health")
+    async def health():
+        result = {"status": "ok", "queue_depth": updates.depth, "workers": updates.workers}
+        if stats is not None:
+            result.update(stats())
+        return result
+
+    return app